@@ -1,12 +1,33 @@
 import sys
 import os
+import json
+import time
+import uuid
+import glob
+import hmac
+import atexit
+import signal
+import socket
+import sqlite3
+import secrets
+import ipaddress
+import threading
+import subprocess
+import argparse
+import asyncio
+import tempfile
+import urllib.request
+import urllib.error
+from concurrent.futures import ThreadPoolExecutor
 from PySide6.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, 
                              QHBoxLayout, QLabel, QLineEdit, QPushButton, 
                              QComboBox, QProgressBar, QFileDialog, QMessageBox,
                              QMenuBar, QMenu, QDialog, QFormLayout, QStyle,
-                             QGroupBox, QDialogButtonBox)
-from PySide6.QtCore import QThread, Signal, QSettings, Qt, QSize, QUrl
-from PySide6.QtGui import QAction, QIcon, QDesktopServices
+                             QGroupBox, QDialogButtonBox, QTableWidget, QTableWidgetItem,
+                             QHeaderView, QTableView, QAbstractItemView, QCheckBox)
+from PySide6.QtCore import (QThread, Signal, QSettings, Qt, QSize, QUrl, QTimer,
+                            QAbstractTableModel, QModelIndex)
+from PySide6.QtGui import QAction, QIcon, QDesktopServices, QPixmap
 import ffmpeg
 import cv2
 import numpy as np
@@ -16,6 +37,1622 @@ import resources_rc  # 这个文件会由 pyside6-rcc 生成
 # 获取当前文件所在目录的绝对路径
 CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
 
+# 支持的输入视频格式
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mkv', '.mov', '.wmv')
+
+# 水印遮罩文件扩展名及默认保存目录
+MASK_FILE_SUFFIX = '.wmask.npz'
+DEFAULT_MASK_DIR = os.path.join(os.path.expanduser('~'), '.video_converter', 'masks')
+
+class JobCancelled(Exception):
+    """任务被取消"""
+
+# 本进程启动的所有ffmpeg子进程，程序退出时统一清理
+_child_processes = set()
+_child_processes_lock = threading.Lock()
+
+def register_child_process(process):
+    with _child_processes_lock:
+        _child_processes.add(process)
+
+def unregister_child_process(process):
+    with _child_processes_lock:
+        _child_processes.discard(process)
+
+@atexit.register
+def kill_child_processes():
+    """确保没有子进程在程序退出后继续运行"""
+    with _child_processes_lock:
+        processes = list(_child_processes)
+        _child_processes.clear()
+    for process in processes:
+        if process.poll() is None:
+            try:
+                set_process_suspended(process, False)
+                process.kill()
+            except OSError:
+                pass
+
+def set_process_suspended(process, suspended):
+    """暂停或恢复子进程（Windows 使用 NtSuspendProcess，其他系统使用 SIGSTOP/SIGCONT）"""
+    if process.poll() is not None:
+        return
+    try:
+        if os.name == 'nt':
+            import ctypes
+            PROCESS_SUSPEND_RESUME = 0x0800
+            handle = ctypes.windll.kernel32.OpenProcess(PROCESS_SUSPEND_RESUME, False, process.pid)
+            if not handle:
+                return
+            try:
+                if suspended:
+                    ctypes.windll.ntdll.NtSuspendProcess(handle)
+                else:
+                    ctypes.windll.ntdll.NtResumeProcess(handle)
+            finally:
+                ctypes.windll.kernel32.CloseHandle(handle)
+        else:
+            os.kill(process.pid, signal.SIGSTOP if suspended else signal.SIGCONT)
+    except OSError:
+        pass
+
+def stop_process(process, timeout=5):
+    """结束子进程并等待其退出，超时后强制杀死"""
+    if process.poll() is None:
+        set_process_suspended(process, False)
+        try:
+            process.terminate()
+            process.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+        except OSError:
+            pass
+    unregister_child_process(process)
+
+def get_partial_path(output_file, suffix=None):
+    """处理过程中写入的临时文件名，完成后再改名为正式输出，失败时不会影响已存在的同名文件"""
+    base_name, ext = os.path.splitext(output_file)
+    return f"{base_name}.partial-{uuid.uuid4().hex[:8]}{suffix or ext}"
+
+def check_output_path(input_file, output_file):
+    """拒绝把输出写到输入文件本身"""
+    def normalize(path):
+        return os.path.normcase(os.path.realpath(path))
+    if normalize(input_file) == normalize(output_file):
+        raise ValueError(f"输出文件不能与输入文件相同: {output_file}")
+
+def remove_partial_output(*paths):
+    """删除取消或失败后留下的临时输出文件"""
+    for path in paths:
+        try:
+            if os.path.isfile(path):
+                os.remove(path)
+                print(f"已删除不完整的输出: {path}")
+        except OSError as e:
+            print(f"删除不完整的输出失败: {path}: {e}")
+
+class JobControl:
+    """任务的取消与暂停控制，由界面或任务服务调用，处理线程在检查点协作响应"""
+
+    def __init__(self):
+        self._cancel_event = threading.Event()
+        self._resume_event = threading.Event()
+        self._resume_event.set()
+        self._lock = threading.Lock()
+        self._processes = []
+
+    @property
+    def cancelled(self):
+        return self._cancel_event.is_set()
+
+    @property
+    def paused(self):
+        return not self._resume_event.is_set()
+
+    def attach_process(self, process):
+        """关联一个子进程，使其跟随任务暂停、恢复和取消"""
+        register_child_process(process)
+        with self._lock:
+            self._processes.append(process)
+            if self.cancelled:
+                process.terminate()
+            elif self.paused:
+                set_process_suspended(process, True)
+
+    def detach_process(self, process):
+        with self._lock:
+            if process in self._processes:
+                self._processes.remove(process)
+
+    def pause(self):
+        with self._lock:
+            if self.cancelled or self.paused:
+                return
+            self._resume_event.clear()
+            for process in self._processes:
+                set_process_suspended(process, True)
+
+    def resume(self):
+        with self._lock:
+            for process in self._processes:
+                set_process_suspended(process, False)
+            self._resume_event.set()
+
+    def cancel(self):
+        with self._lock:
+            self._cancel_event.set()
+            for process in self._processes:
+                set_process_suspended(process, False)
+                try:
+                    process.terminate()
+                except OSError:
+                    pass
+            # 唤醒处于暂停状态的处理线程，让它尽快退出
+            self._resume_event.set()
+
+    def checkpoint(self):
+        """暂停时阻塞，已取消时抛出 JobCancelled"""
+        self._resume_event.wait()
+        if self.cancelled:
+            raise JobCancelled()
+
+def list_video_files(folder):
+    """返回文件夹中所有支持格式的视频文件（按文件名排序）"""
+    return sorted(
+        os.path.join(folder, name) for name in os.listdir(folder)
+        if name.lower().endswith(VIDEO_EXTENSIONS) and os.path.isfile(os.path.join(folder, name))
+    )
+
+def save_watermark_mask(path, watermark_mask, roi=None, source=None, params=None):
+    """将水印遮罩及其元数据压缩保存到磁盘"""
+    if not path.endswith(MASK_FILE_SUFFIX):
+        path = os.path.splitext(path)[0] + MASK_FILE_SUFFIX
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    metadata = {
+        'width': int(watermark_mask.shape[1]),
+        'height': int(watermark_mask.shape[0]),
+        'roi': [int(v) for v in roi] if roi is not None else None,
+        'source': source,
+        'params': params or {},
+        'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+    }
+    # 遮罩只有0/255两种取值，按位打包后体积只有原来的1/8
+    np.savez_compressed(
+        path,
+        mask=np.packbits(watermark_mask > 0),
+        metadata=json.dumps(metadata, ensure_ascii=False)
+    )
+    return path
+
+def load_watermark_mask(path):
+    """从磁盘加载水印遮罩，返回 (遮罩, 元数据)"""
+    with np.load(path) as data:
+        metadata = json.loads(str(data['metadata']))
+        height, width = metadata['height'], metadata['width']
+        bits = np.unpackbits(data['mask'], count=height * width)
+    watermark_mask = (bits.reshape(height, width) * 255).astype(np.uint8)
+    return watermark_mask, metadata
+
+def get_first_valid_frame(video_clip, threshold=10, num_frames=10):
+    total_frames = int(video_clip.fps * video_clip.duration)
+    frame_indices = [int(i * total_frames / num_frames) for i in range(num_frames)]
+
+    for idx in frame_indices:
+        frame = video_clip.get_frame(idx / video_clip.fps)
+        if frame.mean() > threshold:
+            return frame
+
+    return video_clip.get_frame(0)
+
+def detect_watermark_adaptive(frame, roi):
+    roi_frame = frame[roi[1]:roi[1] + roi[3], roi[0]:roi[0] + roi[2]]
+    gray_frame = cv2.cvtColor(roi_frame, cv2.COLOR_BGR2GRAY)
+    _, binary_frame = cv2.threshold(gray_frame, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+
+    mask = np.zeros_like(frame[:, :, 0], dtype=np.uint8)
+    mask[roi[1]:roi[1] + roi[3], roi[0]:roi[0] + roi[2]] = binary_frame
+
+    return mask
+
+def generate_watermark_mask(video_clip, roi, num_frames=10, min_frame_count=7):
+    total_frames = int(video_clip.duration * video_clip.fps)
+    frame_indices = [int(i * total_frames / num_frames) for i in range(num_frames)]
+
+    frames = [video_clip.get_frame(idx / video_clip.fps) for idx in frame_indices]
+    masks = [detect_watermark_adaptive(frame, roi) for frame in frames]
+
+    final_mask = sum((mask == 255).astype(np.uint8) for mask in masks)
+    final_mask = np.where(final_mask >= min_frame_count, 255, 0).astype(np.uint8)
+
+    kernel = np.ones((5, 5), np.uint8)
+    return cv2.dilate(final_mask, kernel)
+
+def get_sample_times(duration, num_samples):
+    """在整段视频中均匀取采样时间点，跳过片头片尾"""
+    return [(i + 0.5) * duration / num_samples for i in range(num_samples)]
+
+def read_keyframes(input_file, times, size=None, crop=None, max_workers=4):
+    """在各时间点取最近的关键帧，裁剪/缩放和灰度转换都在ffmpeg中完成，返回灰度图列表（读取失败的时间点被跳过）；
+    输入端 -ss 快速定位且只解码关键帧，不需要像 moviepy 那样从头解码全分辨率画面"""
+    filters = []
+    if crop:
+        x, y, w, h = crop
+        filters.append(f'crop={w}:{h}:{x}:{y}')
+        out_width, out_height = w, h
+    if size:
+        filters.append(f'scale={size[0]}:{size[1]}:flags=area')
+        out_width, out_height = size
+    filters.append('format=gray')
+
+    def read_one(t):
+        try:
+            data, _ = (
+                ffmpeg.input(input_file, ss=t, skip_frame='nokey', noaccurate_seek=None)
+                .output('pipe:', vframes=1, vf=','.join(filters), f='rawvideo', pix_fmt='gray', loglevel='error')
+                .run(capture_stdout=True, capture_stderr=True)
+            )
+        except ffmpeg.Error:
+            return None
+        if len(data) != out_width * out_height:
+            return None
+        return np.frombuffer(data, np.uint8).reshape(out_height, out_width)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        frames = list(executor.map(read_one, times))
+    return [frame for frame in frames if frame is not None]
+
+def locate_watermark_roi(video_clip, num_samples=16, scale_width=320, edge_ratio=0.8, max_std=12.0, padding=4):
+    """自动定位水印区域：在缩小后的多帧中寻找时间方差低且边缘稳定的区域，返回 (x, y, w, h)，找不到时返回 None"""
+    width, height = video_clip.size
+    scale = scale_width / width
+    small_size = (scale_width, max(int(round(height * scale)), 1))
+
+    frames = read_keyframes(video_clip.filename, get_sample_times(video_clip.duration, num_samples), size=small_size)
+    if len(frames) < 4:
+        return None
+    stack = np.stack(frames).astype(np.float32)
+
+    # 逐像素的时间标准差：水印区域几乎不随画面变化
+    temporal_std = stack.std(axis=0)
+
+    # 逐帧梯度强度，统计每个像素在多少帧中都处于边缘上
+    grad_y, grad_x = np.gradient(stack, axis=(1, 2))
+    edge_fraction = ((np.abs(grad_x) + np.abs(grad_y)) > 20).mean(axis=0)
+
+    candidate = (edge_fraction >= edge_ratio) & (temporal_std <= max_std)
+
+    # 排除黑边与画面的交界线：那里同样是“稳定边缘”，但黑边内部的台标要保留
+    dark = (stack.mean(axis=0) < 16) & (temporal_std < 4)
+    for axis in (1, 0):
+        dark_lines = (dark.mean(axis=axis) > 0.9).astype(np.int8)
+        edges = np.flatnonzero(np.diff(dark_lines))
+        for edge in edges:
+            lo, hi = max(edge - 2, 0), edge + 3
+            if axis == 1:
+                candidate[lo:hi, :] = False
+            else:
+                candidate[:, lo:hi] = False
+
+    # 静态画面（如幻灯片）无法区分水印与内容
+    if candidate.mean() > 0.25:
+        return None
+
+    # 把水印中分散的笔画连成一块，选取稳定边缘最多的连通区域
+    merged = cv2.dilate(candidate.astype(np.uint8), np.ones((5, 5), np.uint8), iterations=2)
+    count, labels, stats, _ = cv2.connectedComponentsWithStats(merged)
+    if count <= 1:
+        return None
+    edge_counts = np.bincount(labels[candidate], minlength=count)
+    edge_counts[0] = 0
+    best = int(np.argmax(edge_counts))
+    if edge_counts[best] < 10:
+        return None
+
+    x, y, w, h = stats[best, :4]
+    x0 = max(int((x - padding) / scale), 0)
+    y0 = max(int((y - padding) / scale), 0)
+    x1 = min(int((x + w + padding) / scale), width)
+    y1 = min(int((y + h + padding) / scale), height)
+    return (x0, y0, x1 - x0, y1 - y0)
+
+def auto_generate_watermark_mask(video_clip, num_frames=10, min_frame_ratio=0.7):
+    """自动定位水印区域并生成遮罩，返回 (遮罩, 区域)；生成遮罩时只解码水印区域内的关键帧"""
+    roi = locate_watermark_roi(video_clip)
+    if roi is None:
+        raise ValueError("未能自动检测到水印区域")
+
+    x, y, w, h = roi
+    crops = read_keyframes(video_clip.filename, get_sample_times(video_clip.duration, num_frames), crop=roi)
+    if not crops:
+        raise ValueError("未能读取视频画面")
+    votes = sum(
+        (cv2.threshold(crop, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)[1] == 255).astype(np.uint8)
+        for crop in crops
+    )
+
+    width, height = video_clip.size
+    watermark_mask = np.zeros((height, width), dtype=np.uint8)
+    watermark_mask[y:y + h, x:x + w] = np.where(votes >= int(np.ceil(len(crops) * min_frame_ratio)), 255, 0)
+    return cv2.dilate(watermark_mask, np.ones((5, 5), np.uint8)), roi
+
+def remove_watermark_frame(frame, watermark_mask, sample_region=None):
+    """改进的水印去除方法"""
+    frame_float = frame.astype(np.float32) / 255.0
+
+    mask_region = watermark_mask > 0
+
+    if sample_region is None:
+        kernel = np.ones((5,5), np.uint8)
+        expanded_mask = cv2.dilate(watermark_mask, kernel, iterations=2)
+        sample_region = expanded_mask > 0
+
+    for c in range(3):
+        channel = frame_float[:,:,c]
+
+        surrounding_pixels = channel[sample_region & ~mask_region]
+        if len(surrounding_pixels) > 0:
+            mean_value = np.mean(surrounding_pixels)
+            std_value = np.std(surrounding_pixels)
+
+            texture = np.random.normal(mean_value, std_value, channel[mask_region].shape)
+
+            channel[mask_region] = np.clip(texture, 0, 1)
+
+    result = cv2.inpaint(
+        (frame_float * 255).astype(np.uint8),
+        watermark_mask,
+        3,
+        cv2.INPAINT_TELEA
+    )
+
+    return np.clip(result, 0, 255).astype(np.uint8)
+
+def remove_watermark_from_video(input_file, output_file, watermark_mask, progress_callback=None, control=None):
+    """对整个视频逐帧去除水印，watermark_mask 为 None 时自动检测水印"""
+    check_output_path(input_file, output_file)
+    partial_file = get_partial_path(output_file)
+    # moviepy 默认把临时音频写到当前工作目录，这里显式放到输出文件旁边以便清理
+    partial_audio = get_partial_path(output_file, '.m4a')
+    video_clip = VideoFileClip(input_file)
+    completed = False
+    try:
+        width, height = video_clip.size
+        if watermark_mask is None:
+            watermark_mask, roi = auto_generate_watermark_mask(video_clip)
+            print(f"自动检测到水印区域: {roi}")
+        if watermark_mask.shape[:2] != (height, width):
+            raise ValueError(
+                f"水印遮罩分辨率 {watermark_mask.shape[1]}x{watermark_mask.shape[0]} "
+                f"与视频分辨率 {width}x{height} 不一致"
+            )
+
+        total_frames = int(video_clip.duration * video_clip.fps)
+        current_frame = 0
+
+        # 采样区域对所有帧都相同，只需计算一次
+        kernel = np.ones((5,5), np.uint8)
+        sample_region = cv2.dilate(watermark_mask, kernel, iterations=2) > 0
+
+        def process_frame(frame):
+            nonlocal current_frame
+            # 每一帧都是一个检查点：暂停时在此等待，取消时抛出异常中止写入
+            if control:
+                control.checkpoint()
+            current_frame += 1
+            # 只在未达到100%时发送进度信号
+            if progress_callback and current_frame < total_frames:
+                progress_callback((current_frame / total_frames) * 100)
+            return remove_watermark_frame(frame, watermark_mask, sample_region)
+
+        processed_video = video_clip.fl_image(process_frame)
+        processed_video.write_videofile(
+            partial_file,
+            temp_audiofile=partial_audio,
+            audio_codec='aac',
+            audio_bitrate='192k',
+            preset='slow',
+            threads=4
+        )
+        processed_video.close()
+        os.replace(partial_file, output_file)
+        completed = True
+    finally:
+        video_clip.close()
+        if not completed:
+            remove_partial_output(partial_file, partial_audio)
+
+def run_watermark_batch(input_files, output_dir, watermark_mask, progress_callback=None, file_callback=None,
+                        control=None):
+    """用同一个遮罩批量去除水印（遮罩为 None 时逐个文件自动检测），返回被跳过的文件及原因列表"""
+    os.makedirs(output_dir, exist_ok=True)
+    skipped = []
+    total = len(input_files)
+
+    for index, input_file in enumerate(input_files):
+        if file_callback:
+            file_callback(input_file)
+        print(f"批量处理 ({index + 1}/{total}): {input_file}")
+
+        base_name = os.path.splitext(os.path.basename(input_file))[0]
+        output_file = os.path.join(output_dir, f"{base_name}_无水印.mp4")
+
+        def file_progress(value, index=index):
+            if progress_callback:
+                progress_callback(min((index + value / 100) / total * 100, 99))
+
+        try:
+            remove_watermark_from_video(input_file, output_file, watermark_mask, file_progress, control)
+        except JobCancelled:
+            raise
+        except Exception as e:
+            print(f"跳过 {input_file}: {e}")
+            skipped.append((input_file, str(e)))
+
+    return skipped
+
+def get_format_settings(output_file):
+    """根据输出文件格式返回适当的编码器设置"""
+    format_ext = output_file.lower().split('.')[-1]
+    settings = {
+        'mp4': {
+            'vcodec': 'libx264',
+            'acodec': 'aac',
+            'strict': 'experimental'
+        },
+        'avi': {
+            'vcodec': 'libx264',
+            'acodec': 'mp3',
+            'strict': 'experimental'
+        },
+        'mkv': {
+            'vcodec': 'libx264',
+            'acodec': 'aac',
+            'strict': 'experimental'
+        },
+        'mov': {
+            'vcodec': 'libx264',
+            'acodec': 'aac',
+            'strict': 'experimental'
+        },
+        'wmv': {
+            'vcodec': 'msmpeg4',
+            'acodec': 'wmav2',
+            'strict': 'experimental'
+        },
+        'm4a': {
+            'acodec': 'aac'
+        },
+        'mp3': {
+            'acodec': 'libmp3lame'
+        },
+        'opus': {
+            'acodec': 'libopus'
+        }
+    }
+    return settings.get(format_ext, {})
+
+# 用 "-" 表示从标准输入读取或写入标准输出
+PIPE_PATH = '-'
+
+# 可以写入标准输出的格式：输出格式 -> ffmpeg封装格式；AVI需要回写索引，不能流式输出
+PIPE_MUXERS = {
+    'mp4': 'mp4',
+    'mov': 'mov',
+    'm4a': 'ipod',
+    'mkv': 'matroska',
+    'wmv': 'asf_stream',
+    'mp3': 'mp3',
+    'opus': 'opus',
+}
+
+# 只输出音频的格式
+AUDIO_FORMATS = ('m4a', 'mp3', 'opus')
+
+# 各容器可以直接复制（不重新编码）的编码：(视频, 音频)
+STREAM_COPY_CODECS = {
+    'mp4': ({'h264', 'hevc', 'mpeg4', 'av1'}, {'aac', 'mp3', 'ac3', 'alac', 'opus'}),
+    'mov': ({'h264', 'hevc', 'mpeg4', 'prores'}, {'aac', 'mp3', 'alac', 'pcm_s16le'}),
+    'mkv': ({'h264', 'hevc', 'mpeg4', 'vp8', 'vp9', 'av1'}, {'aac', 'mp3', 'opus', 'vorbis', 'flac', 'ac3'}),
+    'avi': ({'mpeg4', 'msmpeg4v3', 'mjpeg'}, {'mp3', 'ac3', 'pcm_s16le'}),
+    'wmv': ({'wmv1', 'wmv2', 'msmpeg4v3'}, {'wmav1', 'wmav2'}),
+    'm4a': (set(), {'aac', 'alac'}),
+    'mp3': (set(), {'mp3'}),
+    'opus': (set(), {'opus'}),
+}
+
+# 文本字幕可以转为 mov_text 放入 MP4/MOV，图形字幕只有 MKV 能保留
+TEXT_SUBTITLE_CODECS = {'subrip', 'ass', 'ssa', 'webvtt', 'mov_text', 'text'}
+
+# MKV 能直接保存的字幕编码，其余文本字幕转为SRT
+MATROSKA_SUBTITLE_CODECS = {'subrip', 'ass', 'ssa', 'webvtt', 'dvd_subtitle', 'hdmv_pgs_subtitle', 'dvb_subtitle'}
+
+def parse_time(text):
+    """把 "90"、"1:30"、"00:01:30.5" 这样的时间解析为秒，空字符串返回 None"""
+    text = str(text).strip() if text is not None else ''
+    if not text:
+        return None
+    seconds = 0.0
+    for part in text.split(':'):
+        seconds = seconds * 60 + float(part)
+    if seconds < 0:
+        raise ValueError(f"无效的时间: {text}")
+    return seconds
+
+def is_keyframe_aligned(input_file, start_time, tolerance=0.05):
+    """判断起始时间是否正好落在关键帧上（只读取起点附近的数据）"""
+    probe = ffmpeg.probe(
+        input_file,
+        select_streams='v:0',
+        skip_frame='nokey',
+        show_entries='frame=pts_time',
+        read_intervals=f'{start_time}%+2'
+    )
+    keyframes = [float(frame['pts_time']) for frame in probe.get('frames', []) if 'pts_time' in frame]
+    return any(abs(keyframe - start_time) <= tolerance for keyframe in keyframes)
+
+def get_duration(probe):
+    """从探测结果中取时长：优先使用容器时长，其次取各流中最长的"""
+    duration = probe.get('format', {}).get('duration')
+    if duration:
+        return float(duration)
+    durations = [float(s['duration']) for s in probe['streams'] if s.get('duration')]
+    return max(durations) if durations else None
+
+def plan_streams(probe, output_format, allow_video_copy=True):
+    """根据探测结果为每个输入流选择 copy / transcode / drop，只做必要的处理"""
+    video_codecs, audio_codecs = STREAM_COPY_CODECS.get(output_format, (set(), set()))
+    format_settings = get_format_settings(output_format)
+    audio_only = output_format in AUDIO_FORMATS
+    plan = []
+    has_video = False
+
+    # 纯音频格式只能容纳一路音轨：取默认音轨，没有标记默认时取第一路
+    main_audio = None
+    if audio_only:
+        audios = [s for s in probe['streams'] if s.get('codec_type') == 'audio']
+        main_audio = next((s for s in audios if s.get('disposition', {}).get('default') == 1), None)
+        main_audio = main_audio or (audios[0] if audios else None)
+
+    for stream in probe['streams']:
+        codec_type, codec_name = stream.get('codec_type'), stream.get('codec_name')
+        entry = {'index': stream['index'], 'type': codec_type, 'codec': codec_name, 'action': 'drop'}
+
+        if codec_type == 'video':
+            # 封面图片不是真正的视频流；只保留第一路视频
+            is_cover = stream.get('disposition', {}).get('attached_pic') == 1
+            if not audio_only and not is_cover and not has_video:
+                has_video = True
+                if allow_video_copy and codec_name in video_codecs:
+                    entry['action'] = 'copy'
+                else:
+                    entry.update(action='transcode', encoder=format_settings.get('vcodec', 'libx264'), bitrate='2500k')
+        elif codec_type == 'audio' and (not audio_only or stream is main_audio):
+            if codec_name in audio_codecs:
+                entry['action'] = 'copy'
+            else:
+                entry.update(action='transcode', encoder=format_settings.get('acodec', 'aac'), bitrate='192k')
+        elif codec_type == 'subtitle' and not audio_only:
+            if output_format == 'mkv':
+                if codec_name in MATROSKA_SUBTITLE_CODECS:
+                    entry['action'] = 'copy'
+                elif codec_name in TEXT_SUBTITLE_CODECS:
+                    entry.update(action='transcode', encoder='srt')
+            elif output_format in ('mp4', 'mov') and codec_name in TEXT_SUBTITLE_CODECS:
+                if codec_name == 'mov_text':
+                    entry['action'] = 'copy'
+                else:
+                    entry.update(action='transcode', encoder='mov_text')
+        elif codec_type == 'attachment' and output_format == 'mkv':
+            # 字体等附件只有MKV能保留
+            entry['action'] = 'copy'
+
+        plan.append(entry)
+
+    if not any(entry['action'] != 'drop' and entry['type'] in ('video', 'audio') for entry in plan):
+        raise ValueError("输入文件中没有可输出的音频或视频流" if not audio_only else "输入文件中没有音轨")
+    return plan
+
+def build_planned_output(input_stream, output_file, plan, output_options):
+    """按流处理计划生成ffmpeg输出：逐个映射保留的流，并为每个输出流指定编码方式"""
+    streams = []
+    options = dict(output_options)
+    for entry in plan:
+        if entry['action'] == 'drop':
+            continue
+        output_index = len(streams)
+        streams.append(input_stream[str(entry['index'])])
+        if entry['action'] == 'copy':
+            options[f'c:{output_index}'] = 'copy'
+        else:
+            options[f'c:{output_index}'] = entry['encoder']
+            if entry.get('bitrate'):
+                options[f'b:{output_index}'] = entry['bitrate']
+    return ffmpeg.output(*streams, output_file, **options)
+
+# 流媒体打包格式：输出文件扩展名 -> 格式
+PACKAGING_FORMATS = {'m3u8': 'hls', 'mpd': 'dash'}
+
+# 多码率打包的清晰度阶梯：(高度, 视频码率, 音频码率)
+PACKAGING_RENDITIONS = [
+    (1080, '5000k', '192k'),
+    (720, '2800k', '128k'),
+    (480, '1400k', '96k'),
+]
+
+# 打包时每个分片的时长（秒）
+SEGMENT_DURATION = 6
+
+def get_output_name(base_name, output_format):
+    """输出文件名；HLS/DASH 输出到单独的目录，返回其中的主播放列表"""
+    output_format = output_format.lower()
+    if output_format == 'hls':
+        return os.path.join(f"{base_name}_hls", "master.m3u8")
+    if output_format == 'dash':
+        return os.path.join(f"{base_name}_dash", "manifest.mpd")
+    return f"{base_name}.{output_format}"
+
+def get_output_format(output_file):
+    """根据输出文件扩展名判断输出格式，.m3u8/.mpd 分别对应 HLS/DASH 打包"""
+    format_ext = output_file.lower().split('.')[-1]
+    return PACKAGING_FORMATS.get(format_ext, format_ext)
+
+def get_main_streams(probe):
+    """取第一路真正的视频流（跳过封面图片）和第一路音频流，不存在时为 None"""
+    streams = probe['streams'] if probe else []
+    video = next((s for s in streams if s.get('codec_type') == 'video'
+                  and s.get('disposition', {}).get('attached_pic') != 1), None)
+    audio = next((s for s in streams if s.get('codec_type') == 'audio'), None)
+    return video, audio
+
+def get_packaging_renditions(probe, adaptive):
+    """选择打包的清晰度：多码率时取不超过源分辨率的各档，否则只输出源分辨率一路"""
+    video = get_main_streams(probe)[0]
+    if not adaptive or video is None:
+        return [(None, '2500k', '192k')]
+    source_height = int(video['height'])
+    # 与源分辨率相同的一档不需要缩放
+    renditions = [
+        (None if height == source_height else height, video_bitrate, audio_bitrate)
+        for height, video_bitrate, audio_bitrate in PACKAGING_RENDITIONS if height <= source_height
+    ]
+    return renditions or [(None,) + PACKAGING_RENDITIONS[-1][1:]]
+
+def build_packaging_output(input_stream, output_file, output_format, probe, adaptive, output_options):
+    """在同一个ffmpeg进程中完成转码与HLS/DASH分片打包，源文件只解码一次"""
+    output_dir = os.path.dirname(os.path.abspath(output_file))
+    os.makedirs(output_dir, exist_ok=True)
+
+    # 只取一路视频和一路音频，封面图片和其他音轨不参与打包
+    video_stream, audio_stream = get_main_streams(probe)
+    source_video = input_stream[str(video_stream['index'])]
+    source_audio = input_stream[str(audio_stream['index'])] if audio_stream else None
+    has_audio = source_audio is not None
+    renditions = get_packaging_renditions(probe, adaptive)
+    count = len(renditions)
+
+    # 多路输出时拆分解码后的画面和声音，各自缩放/编码
+    videos = source_video.filter_multi_output('split', count) if count > 1 else None
+    audios = source_audio.filter_multi_output('asplit', count) if count > 1 and has_audio else None
+
+    streams = []
+    options = dict(output_options)
+    options.update({
+        'vcodec': 'libx264',
+        'acodec': 'aac',
+        # 固定间隔插入关键帧，保证各路分片边界对齐
+        'force_key_frames': f'expr:gte(t,n_forced*{SEGMENT_DURATION})',
+        'sc_threshold': 0,
+    })
+    stream_map = []
+    for i, (height, video_bitrate, audio_bitrate) in enumerate(renditions):
+        video = videos[i] if videos is not None else source_video
+        if height:
+            video = video.filter('scale', -2, height)
+        streams.append(video)
+        options[f'b:v:{i}'] = video_bitrate
+        entry = f'v:{i}'
+        if has_audio:
+            streams.append(audios[i] if audios is not None else source_audio)
+            options[f'b:a:{i}'] = audio_bitrate
+            entry += f',a:{i}'
+        stream_map.append(entry)
+
+    if output_format == 'hls':
+        options.update({
+            'f': 'hls',
+            'hls_time': SEGMENT_DURATION,
+            'hls_playlist_type': 'vod',
+            'hls_segment_type': 'fmp4',
+            'hls_fmp4_init_filename': 'init_%v.mp4',
+            'hls_segment_filename': os.path.join(output_dir, 'stream_%v_%05d.m4s'),
+            'master_pl_name': os.path.basename(output_file),
+            'var_stream_map': ' '.join(stream_map),
+        })
+        target = os.path.join(output_dir, 'stream_%v.m3u8')
+    else:
+        options.update({
+            'f': 'dash',
+            'seg_duration': SEGMENT_DURATION,
+            'use_template': 1,
+            'use_timeline': 1,
+            'adaptation_sets': 'id=0,streams=v id=1,streams=a' if has_audio else 'id=0,streams=v',
+        })
+        target = output_file
+
+    return ffmpeg.output(*streams, target, **options)
+
+def remove_partial_package(output_file):
+    """删除取消或失败后留下的播放列表和分片"""
+    output_dir = os.path.dirname(os.path.abspath(output_file))
+    patterns = ['stream_*.m3u8', 'stream_*_*.m4s', 'init_*.mp4', 'init-stream*', 'chunk-stream*']
+    for pattern in patterns:
+        for path in glob.glob(os.path.join(glob.escape(output_dir), pattern)):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+    remove_partial_output(output_file)
+
+def convert_video(input_file, output_file, progress_callback=None, control=None,
+                  start_time=None, end_time=None, output_format=None, adaptive=False):
+    """使用ffmpeg转换视频格式，可只转换 start_time 到 end_time 之间的片段；
+    input_file/output_file 为 "-" 时从标准输入读取或写入标准输出（fMP4）；
+    输出为 .m3u8/.mpd 时直接打包为HLS/DASH，adaptive 为 True 时输出多码率"""
+    process = None
+    completed = False
+    read_stdin = input_file == PIPE_PATH
+    write_stdout = output_file == PIPE_PATH
+    output_format = (output_format or ('mp4' if write_stdout else get_output_format(output_file))).lower()
+    packaging = output_format in PACKAGING_FORMATS.values()
+    # 先写入临时文件，成功后再改名；打包输出只在本次新建时才清理
+    partial_file = None if write_stdout or packaging else get_partial_path(output_file)
+    package_existed = packaging and os.path.exists(output_file)
+    try:
+        if not (read_stdin or write_stdout):
+            check_output_path(input_file, output_file)
+        if start_time is not None and end_time is not None and end_time <= start_time:
+            raise ValueError("结束时间必须晚于开始时间")
+        if packaging and write_stdout:
+            raise ValueError("HLS/DASH 打包需要输出到目录，不能写入标准输出")
+        if packaging and read_stdin:
+            # 打包需要预先知道有哪些音视频流，标准输入无法探测
+            raise ValueError("HLS/DASH 打包不能从标准输入读取")
+        if write_stdout and output_format not in PIPE_MUXERS:
+            raise ValueError(f"{output_format} 格式不能写入标准输出")
+
+        # 获取视频总时长（标准输入无法预先探测）
+        probe = None if read_stdin else ffmpeg.probe(input_file)
+        total_duration = get_duration(probe) if probe else None
+        if end_time is not None:
+            total_duration = end_time - (start_time or 0)
+        elif total_duration is not None and start_time:
+            total_duration = max(total_duration - start_time, 0.001)
+
+        # 输入端 -ss 快速定位，不需要解码起点之前的内容
+        input_options = {}
+        if start_time:
+            input_options['ss'] = start_time
+
+        trimming = start_time is not None or end_time is not None
+        plan = None
+        if packaging:
+            if get_main_streams(probe)[0] is None:
+                raise ValueError("HLS/DASH 打包需要输入文件包含视频")
+            output_options = {}
+        elif probe:
+            # 根据各个流的编码决定复制、转码还是丢弃
+            plan = plan_streams(probe, output_format)
+            copies_video = any(e['type'] == 'video' and e['action'] == 'copy' for e in plan)
+            if copies_video and start_time:
+                # 起点不在关键帧上时复制视频会导致开头花屏，改为转码
+                try:
+                    aligned = is_keyframe_aligned(input_file, start_time)
+                except ffmpeg.Error:
+                    aligned = False
+                if not aligned:
+                    plan = plan_streams(probe, output_format, allow_video_copy=False)
+            print("流处理计划: " + ", ".join(
+                f"#{e['index']} {e['type']}({e['codec']}) -> {e['action']}" for e in plan
+            ))
+
+            output_options = {}
+            if any(e['action'] == 'transcode' for e in plan) and 'strict' in get_format_settings(output_format):
+                output_options['strict'] = 'experimental'
+            if any(e['type'] == 'video' and e['action'] == 'transcode' for e in plan) and not trimming:
+                output_options.update({'copyts': None, 'vsync': 0})
+            elif trimming and any(e['action'] == 'copy' for e in plan):
+                output_options['avoid_negative_ts'] = 'make_zero'
+        else:
+            # 获取输出格式的编码器设置
+            output_options = dict(get_format_settings(output_format), **{'b:a': '192k'})
+            if output_format in AUDIO_FORMATS:
+                # 无法预先探测时同样只输出音频，不解码视频和字幕
+                output_options.update({'vn': None, 'sn': None})
+            else:
+                output_options['b:v'] = '2500k'
+                if not trimming:
+                    output_options.update({'copyts': None, 'vsync': 0})
+
+        if end_time is not None:
+            output_options['t'] = end_time - (start_time or 0)
+
+        if write_stdout:
+            output_options['f'] = PIPE_MUXERS[output_format]
+            if output_format in ('mp4', 'mov', 'm4a'):
+                # 标准输出不可回写，MP4系列使用分片模式以便下游边接收边处理
+                output_options['movflags'] = 'frag_keyframe+empty_moov+default_base_moof'
+
+        # 设置ffmpeg命令
+        input_stream = ffmpeg.input('pipe:' if read_stdin else input_file, **input_options)
+        output_options.update({
+            'loglevel': 'info',
+            'stats': None,
+        })
+        if packaging:
+            stream = build_packaging_output(
+                input_stream, output_file, output_format, probe, adaptive, output_options
+            ).overwrite_output()
+        elif plan is not None:
+            stream = build_planned_output(
+                input_stream, 'pipe:' if write_stdout else partial_file, plan, output_options
+            ).overwrite_output()
+        else:
+            stream = input_stream.output('pipe:' if write_stdout else partial_file, **output_options).overwrite_output()
+
+        # 获取完整的ffmpeg命令用于调试
+        cmd = ffmpeg.compile(stream)
+        print(f"开始转换: {' '.join(cmd)}")
+
+        # 标准输入/输出直接交给ffmpeg继承，数据不经过本进程
+        process = stream.run_async(pipe_stdout=not write_stdout, pipe_stderr=True)
+        if control:
+            control.attach_process(process)
+        else:
+            register_child_process(process)
+
+        # 收集错误输出
+        error_output = []
+        last_progress = 0
+
+        # 监控转换进度
+        while process.poll() is None:
+            line = process.stderr.readline().decode('utf8', errors='replace')
+            if line:
+                print(f"FFmpeg output: {line.strip()}")
+                error_output.append(line)
+
+                # 尝试从不同格式的时间信息中提取进度
+                try:
+                    if "time=" in line:
+                        # 提取时间信息
+                        time_str = line.split("time=")[1].split()[0]
+                        if time_str != 'N/A':
+                            # 将时间转换为秒
+                            if ":" in time_str:
+                                h, m, s = map(float, time_str.split(':'))
+                                current_seconds = h * 3600 + m * 60 + s
+                            else:
+                                current_seconds = float(time_str)
+
+                            # 计算进度百分比
+                            if not total_duration:
+                                continue
+                            progress = min((current_seconds / total_duration) * 100, 99)
+                            if progress > last_progress:
+                                if progress_callback:
+                                    progress_callback(progress)
+                                last_progress = progress
+                                print(f"转换进度: {progress:.1f}%")
+                except Exception as e:
+                    print(f"Progress parsing error: {e}")
+                    continue
+
+        process.wait()
+
+        # 取消时ffmpeg被终止，这里不再当作转换失败
+        if control and control.cancelled:
+            raise JobCancelled()
+
+        if process.returncode != 0:
+            error_msg = ''.join(error_output)
+            print(f"转换失败: {error_msg}")
+            raise Exception(f"转换失败。FFmpeg输出:\n{error_msg}")
+
+        if partial_file:
+            os.replace(partial_file, output_file)
+        print("转换完成")
+        completed = True
+    finally:
+        # 确保在结束时关闭所有资源
+        if process is not None:
+            if control:
+                control.detach_process(process)
+            stop_process(process)
+        if not completed and packaging and process is not None and not package_existed:
+            remove_partial_package(output_file)
+        elif not completed and partial_file:
+            remove_partial_output(partial_file)
+
+def run_job(job_type, params, progress_callback=None, control=None):
+    """按任务类型调用对应的处理引擎（供任务服务使用）"""
+    if job_type == 'convert':
+        convert_video(
+            params['input'],
+            params['output'],
+            progress_callback=progress_callback,
+            control=control,
+            start_time=parse_time(params.get('start')),
+            end_time=parse_time(params.get('end')),
+            adaptive=bool(params.get('adaptive'))
+        )
+    elif job_type == 'watermark':
+        watermark_mask = None
+        if params.get('mask'):
+            watermark_mask, _ = load_watermark_mask(params['mask'])
+        remove_watermark_from_video(params['input'], params['output'], watermark_mask, progress_callback, control)
+    else:
+        raise ValueError(f"未知的任务类型: {job_type}")
+
+# 任务服务默认监听地址
+DEFAULT_SERVICE_HOST = '127.0.0.1'
+DEFAULT_SERVICE_PORT = 8765
+
+# 任务服务的访问令牌：服务启动时生成，本机客户端从同一文件读取
+SERVICE_TOKEN_FILE = os.path.join(os.path.expanduser('~'), '.video_converter', 'service_token')
+SERVICE_TOKEN_HEADER = 'X-Job-Token'
+
+def load_service_token(create=False):
+    """读取任务服务的访问令牌，create 为 True 且令牌不存在时生成一个新令牌"""
+    try:
+        with open(SERVICE_TOKEN_FILE, encoding='utf-8') as f:
+            token = f.read().strip()
+        if token:
+            return token
+    except FileNotFoundError:
+        pass
+    if not create:
+        return None
+    token = secrets.token_urlsafe(32)
+    os.makedirs(os.path.dirname(SERVICE_TOKEN_FILE), exist_ok=True)
+    # 令牌文件只允许当前用户读取
+    fd = os.open(SERVICE_TOKEN_FILE, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        f.write(token)
+    return token
+
+def is_loopback_host(host):
+    """监听地址是否只对本机开放"""
+    if host == 'localhost':
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+class JobService:
+    """基于asyncio的本地任务服务，通过HTTP接口提交、查询、暂停和取消转换/去水印任务"""
+
+    def __init__(self, max_workers=2, token=None):
+        self.max_workers = max_workers
+        self.token = token
+        self.jobs = {}
+        self.controls = {}
+        self.queue = None
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    def submit(self, job_type, params):
+        if job_type not in ('convert', 'watermark'):
+            raise ValueError(f"未知的任务类型: {job_type}")
+        if not params.get('input') or not params.get('output'):
+            raise ValueError("任务需要指定 input 和 output")
+
+        job = {
+            'id': uuid.uuid4().hex[:12],
+            'type': job_type,
+            'params': params,
+            'status': 'queued',
+            'progress': 0.0,
+            'error': None,
+            'created': time.time(),
+            'started': None,
+            'finished': None,
+        }
+        self.jobs[job['id']] = job
+        self.controls[job['id']] = JobControl()
+        self.queue.put_nowait(job['id'])
+        print(f"任务已提交: {job['id']} ({job_type}) {params['input']}")
+        return job
+
+    def cancel(self, job_id):
+        job = self.jobs[job_id]
+        if job['status'] == 'queued':
+            job['status'] = 'cancelled'
+            job['finished'] = time.time()
+            self.controls.pop(job_id, None)
+        elif job['status'] in ('running', 'paused'):
+            self.controls[job_id].cancel()
+        return job
+
+    def pause(self, job_id):
+        job = self.jobs[job_id]
+        if job['status'] == 'running':
+            self.controls[job_id].pause()
+            job['status'] = 'paused'
+        return job
+
+    def resume(self, job_id):
+        job = self.jobs[job_id]
+        if job['status'] == 'paused':
+            self.controls[job_id].resume()
+            job['status'] = 'running'
+        return job
+
+    async def _worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            job_id = await self.queue.get()
+            job = self.jobs[job_id]
+            if job['status'] != 'queued':
+                continue
+
+            job['status'] = 'running'
+            job['started'] = time.time()
+
+            def progress_callback(value, job=job):
+                job['progress'] = round(float(value), 1)
+
+            try:
+                await loop.run_in_executor(
+                    self.executor, run_job, job['type'], job['params'], progress_callback, self.controls[job_id]
+                )
+                job['status'] = 'finished'
+                job['progress'] = 100.0
+            except JobCancelled:
+                job['status'] = 'cancelled'
+            except Exception as e:
+                job['status'] = 'failed'
+                job['error'] = str(e)
+            job['finished'] = time.time()
+            self.controls.pop(job_id, None)
+            print(f"任务结束: {job_id} -> {job['status']}")
+
+    def _public(self, job):
+        return dict(job)
+
+    def route(self, method, path, body):
+        """处理一次请求，返回 (HTTP状态码, JSON对象)"""
+        parts = [part for part in path.split('?')[0].split('/') if part]
+        if parts[:1] != ['jobs']:
+            return 404, {'error': "未知的接口"}
+
+        if len(parts) == 1:
+            if method == 'GET':
+                return 200, {'jobs': [self._public(job) for job in self.jobs.values()]}
+            if method == 'POST':
+                try:
+                    request = json.loads(body or b'{}')
+                    if not isinstance(request, dict):
+                        raise ValueError("请求体必须是JSON对象")
+                    job = self.submit(request.get('type', 'convert'), request)
+                except ValueError as e:
+                    return 400, {'error': str(e)}
+                return 201, self._public(job)
+            return 405, {'error': "不支持的请求方法"}
+
+        job_id = parts[1]
+        if job_id not in self.jobs:
+            return 404, {'error': f"任务不存在: {job_id}"}
+        if len(parts) == 2 and method == 'GET':
+            return 200, self._public(self.jobs[job_id])
+        if (len(parts) == 2 and method == 'DELETE') or (parts[2:] == ['cancel'] and method == 'POST'):
+            return 200, self._public(self.cancel(job_id))
+        if parts[2:] == ['pause'] and method == 'POST':
+            return 200, self._public(self.pause(job_id))
+        if parts[2:] == ['resume'] and method == 'POST':
+            return 200, self._public(self.resume(job_id))
+        return 405, {'error': "不支持的请求方法"}
+
+    def check_request(self, method, headers):
+        """校验请求来源和令牌，通过时返回 None，否则返回 (HTTP状态码, JSON对象)"""
+        # 浏览器中的网页发出的跨站请求都会带 Origin，一律拒绝
+        if 'origin' in headers:
+            return 403, {'error': "不接受来自网页的请求"}
+        content_type = headers.get('content-type', '').split(';')[0].strip().lower()
+        if method == 'POST' and content_type != 'application/json':
+            return 415, {'error': "请求体必须是 application/json"}
+        if not hmac.compare_digest(headers.get(SERVICE_TOKEN_HEADER.lower(), '').encode('utf-8'),
+                                   self.token.encode('utf-8')):
+            return 401, {'error': "访问令牌无效"}
+        return None
+
+    async def handle_client(self, reader, writer):
+        try:
+            request_line = (await reader.readline()).decode('latin-1').split()
+            headers = {}
+            while True:
+                line = (await reader.readline()).decode('latin-1').strip()
+                if not line:
+                    break
+                key, _, value = line.partition(':')
+                headers[key.strip().lower()] = value.strip()
+            body = await reader.readexactly(int(headers.get('content-length', 0) or 0))
+
+            if len(request_line) < 2:
+                status, payload = 400, {'error': "无效的请求"}
+            else:
+                method = request_line[0].upper()
+                status, payload = self.check_request(method, headers) or self.route(method, request_line[1], body)
+        except Exception as e:
+            status, payload = 500, {'error': str(e)}
+
+        data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        reason = {200: 'OK', 201: 'Created', 400: 'Bad Request', 401: 'Unauthorized', 403: 'Forbidden',
+                  404: 'Not Found', 405: 'Method Not Allowed', 415: 'Unsupported Media Type',
+                  500: 'Internal Server Error'}.get(status, 'OK')
+        writer.write(
+            f"HTTP/1.1 {status} {reason}\r\n"
+            f"Content-Type: application/json; charset=utf-8\r\n"
+            f"Content-Length: {len(data)}\r\n"
+            f"Connection: close\r\n\r\n".encode('latin-1') + data
+        )
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def serve(self, host=DEFAULT_SERVICE_HOST, port=DEFAULT_SERVICE_PORT):
+        if self.token is None:
+            # 服务会以当前用户身份读写任意路径，对外开放时必须显式指定令牌
+            if not is_loopback_host(host):
+                raise ValueError(f"监听非本机地址 {host} 时必须用 --token 指定访问令牌")
+            self.token = load_service_token(create=True)
+            print(f"访问令牌保存在: {SERVICE_TOKEN_FILE}")
+        self.queue = asyncio.Queue()
+        workers = [asyncio.create_task(self._worker()) for _ in range(self.max_workers)]
+        server = await asyncio.start_server(self.handle_client, host, port)
+        print(f"任务服务已启动: http://{host}:{port} (并发数 {self.max_workers})")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            # 服务退出前取消所有正在运行的任务，避免留下孤立的ffmpeg进程
+            for control in list(self.controls.values()):
+                control.cancel()
+            for worker in workers:
+                worker.cancel()
+            self.executor.shutdown(wait=True)
+
+class JobServiceClient:
+    """任务服务的HTTP客户端"""
+
+    def __init__(self, base_url, token=None):
+        self.base_url = base_url.rstrip('/')
+        self.token = token or load_service_token() or ''
+
+    def _request(self, method, path, payload=None):
+        data = json.dumps(payload).encode('utf-8') if payload is not None else None
+        request = urllib.request.Request(
+            self.base_url + path,
+            data=data,
+            method=method,
+            headers={'Content-Type': 'application/json', SERVICE_TOKEN_HEADER: self.token}
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=10) as response:
+                return json.loads(response.read().decode('utf-8'))
+        except urllib.error.HTTPError as e:
+            raise Exception(json.loads(e.read().decode('utf-8')).get('error', str(e)))
+
+    def submit(self, job_type, **params):
+        return self._request('POST', '/jobs', dict(params, type=job_type))
+
+    def status(self, job_id):
+        return self._request('GET', f'/jobs/{job_id}')
+
+    def cancel(self, job_id):
+        return self._request('POST', f'/jobs/{job_id}/cancel', {})
+
+    def pause(self, job_id):
+        return self._request('POST', f'/jobs/{job_id}/pause', {})
+
+    def resume(self, job_id):
+        return self._request('POST', f'/jobs/{job_id}/resume', {})
+
+    def list_jobs(self):
+        return self._request('GET', '/jobs')['jobs']
+
+class FileJobQueue:
+    """基于共享目录的分布式任务队列，多台机器上的工作进程通过原子重命名领取任务"""
+
+    STATES = ('pending', 'running', 'done', 'failed')
+
+    def __init__(self, queue_dir):
+        self.queue_dir = queue_dir
+        for name in self.STATES + ('workers',):
+            os.makedirs(os.path.join(queue_dir, name), exist_ok=True)
+
+    def _path(self, state, name):
+        return os.path.join(self.queue_dir, state, name)
+
+    def _write(self, path, data):
+        # 先写临时文件再替换，避免其他进程读到写了一半的文件
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def _read(self, path):
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+
+    def _list(self, state):
+        return sorted(name for name in os.listdir(os.path.join(self.queue_dir, state)) if name.endswith('.json'))
+
+    def _now(self):
+        """以共享存储的时钟为准，避免各台机器时钟不一致导致误判"""
+        clock_path = os.path.join(self.queue_dir, '.clock')
+        with open(clock_path, 'w'):
+            pass
+        return os.path.getmtime(clock_path)
+
+    def enqueue(self, job_type, params):
+        if job_type not in ('convert', 'watermark'):
+            raise ValueError(f"未知的任务类型: {job_type}")
+        job = {
+            'id': uuid.uuid4().hex[:12],
+            'type': job_type,
+            'params': params,
+            'attempts': 0,
+            'created': time.time(),
+            'error': None,
+        }
+        # 文件名以时间开头，保证先提交的任务先被领取
+        name = f"{time.time_ns():020d}-{job['id']}.json"
+        self._write(self._path('pending', name), job)
+        return job
+
+    def claim(self, worker_id):
+        """领取一个待处理任务，没有任务时返回 None"""
+        for name in self._list('pending'):
+            pending_path = self._path('pending', name)
+            running_path = self._path('running', name)
+            try:
+                # 重命名会保留提交时的修改时间，先刷新为领取时间，
+                # 否则协调进程会把刚领取的任务当作早已超时
+                os.utime(pending_path)
+                os.rename(pending_path, running_path)
+            except OSError:
+                # 已被其他工作进程领取
+                continue
+            try:
+                job = self._read(running_path)
+                job['attempts'] += 1
+                job['worker'] = worker_id
+                job['started'] = time.time()
+                self._write(running_path, job)
+            except (OSError, ValueError) as e:
+                print(f"领取任务 {name} 失败: {e}")
+                continue
+            job['_name'] = name
+            return job
+        return None
+
+    def complete(self, job, error=None):
+        name = job.pop('_name')
+        job['finished'] = time.time()
+        job['error'] = error
+        running_path = self._path('running', name)
+        try:
+            current = self._read(running_path)
+        except (OSError, ValueError):
+            current = None
+        # 任务被判定超时并重新排队后文件名不变，可能已被其他工作进程重新领取，
+        # 因此要核对领取者和尝试次数，而不只是文件是否存在
+        if current is None or current.get('worker') != job.get('worker') or current.get('attempts') != job['attempts']:
+            print(f"任务 {job['id']} 已不属于本工作进程，忽略结果")
+            return
+        self._write(self._path('failed' if error else 'done', name), job)
+        os.remove(running_path)
+
+    def heartbeat(self, worker_id, job=None, progress=0.0):
+        self._write(self._path('workers', f"{worker_id}.json"), {
+            'worker': worker_id,
+            'host': socket.gethostname(),
+            'pid': os.getpid(),
+            'job': job['id'] if job else None,
+            'progress': round(float(progress), 1),
+            'time': time.time(),
+        })
+
+    def workers(self):
+        """返回所有工作进程的心跳信息，附带距上次心跳的秒数"""
+        now = self._now()
+        result = {}
+        for name in self._list('workers'):
+            path = self._path('workers', name)
+            try:
+                info = self._read(path)
+                info['age'] = now - os.path.getmtime(path)
+            except (OSError, ValueError):
+                continue
+            result[info['worker']] = info
+        return result
+
+    def requeue_stale(self, timeout=60, max_attempts=3):
+        """把心跳超时的工作进程手中的任务重新排队，超过重试次数的标记为失败"""
+        workers = self.workers()
+        now = self._now()
+        for name in self._list('running'):
+            running_path = self._path('running', name)
+            try:
+                job = self._read(running_path)
+                claimed_age = now - os.path.getmtime(running_path)
+            except (OSError, ValueError):
+                continue
+            if claimed_age < timeout:
+                # 刚领取的任务可能还没来得及写心跳
+                continue
+            worker = workers.get(job.get('worker'))
+            if worker is not None and worker['age'] < timeout and worker['job'] == job['id']:
+                continue
+
+            job['error'] = f"工作进程 {job.get('worker')} 失去响应"
+            if job['attempts'] >= max_attempts:
+                print(f"任务 {job['id']} 重试 {job['attempts']} 次后仍失败")
+                self._write(self._path('failed', name), job)
+            else:
+                print(f"任务 {job['id']} 重新排队 (第 {job['attempts']} 次尝试失败)")
+                self._write(self._path('pending', name), job)
+            try:
+                os.remove(running_path)
+            except FileNotFoundError:
+                pass
+
+    def status(self):
+        """汇总队列状态及各运行中任务的进度"""
+        workers = self.workers()
+        progress = {info['job']: info for info in workers.values() if info['job']}
+        running = []
+        for name in self._list('running'):
+            try:
+                job = self._read(self._path('running', name))
+            except (OSError, ValueError):
+                continue
+            info = progress.get(job['id'], {})
+            job['progress'] = info.get('progress', 0.0)
+            running.append(job)
+
+        counts = {state: len(self._list(state)) for state in self.STATES}
+        total = sum(counts.values())
+        done_progress = counts['done'] + counts['failed'] + sum(job['progress'] for job in running) / 100
+        return {
+            'counts': counts,
+            'running': running,
+            'workers': list(workers.values()),
+            'progress': done_progress / total * 100 if total else 100.0,
+        }
+
+def run_queue_worker(queue_dir, worker_id=None, poll_interval=2, heartbeat_interval=5):
+    """工作进程：不断从共享队列领取任务并处理"""
+    queue = FileJobQueue(queue_dir)
+    worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+    state = {'job': None, 'progress': 0.0}
+    stop_event = threading.Event()
+
+    def beat():
+        # 共享存储偶尔出错时只跳过这一次心跳，下次继续发送
+        try:
+            queue.heartbeat(worker_id, state['job'], state['progress'])
+        except OSError as e:
+            print(f"发送心跳失败: {e}")
+
+    def send_heartbeats():
+        while not stop_event.wait(heartbeat_interval):
+            beat()
+
+    heartbeat_thread = threading.Thread(target=send_heartbeats, daemon=True)
+    heartbeat_thread.start()
+    print(f"工作进程 {worker_id} 已启动，队列目录: {queue_dir}")
+
+    try:
+        while True:
+            beat()
+            job = queue.claim(worker_id)
+            if job is None:
+                time.sleep(poll_interval)
+                continue
+
+            print(f"开始处理任务 {job['id']} ({job['type']}) {job['params']['input']}")
+            state['job'], state['progress'] = job, 0.0
+            beat()
+
+            def progress_callback(value):
+                state['progress'] = value
+
+            try:
+                run_job(job['type'], job['params'], progress_callback)
+                queue.complete(job)
+                print(f"任务 {job['id']} 完成")
+            except Exception as e:
+                queue.complete(job, error=str(e))
+                print(f"任务 {job['id']} 失败: {e}")
+            state['job'], state['progress'] = None, 0.0
+    finally:
+        stop_event.set()
+
+def run_queue_coordinator(queue_dir, timeout=60, max_attempts=3, interval=10):
+    """协调进程：定期回收失去响应的工作进程手中的任务，并输出汇总进度"""
+    queue = FileJobQueue(queue_dir)
+    print(f"协调进程已启动，队列目录: {queue_dir}")
+    while True:
+        queue.requeue_stale(timeout, max_attempts)
+        status = queue.status()
+        counts = status['counts']
+        alive = sum(1 for worker in status['workers'] if worker['age'] < timeout)
+        print(
+            f"等待 {counts['pending']} / 运行 {counts['running']} / 完成 {counts['done']} / "
+            f"失败 {counts['failed']}，在线工作进程 {alive}，总进度 {status['progress']:.1f}%"
+        )
+        time.sleep(interval)
+
+# 媒体库索引默认保存位置
+DEFAULT_INDEX_PATH = os.path.join(os.path.expanduser('~'), '.video_converter', 'library.db')
+
+def extract_media_info(path, num_thumbnails=3, thumbnail_width=160):
+    """读取视频的元数据，并在几个时间点截取关键帧缩略图（JPEG）"""
+    probe = ffmpeg.probe(path)
+    video = next((s for s in probe['streams'] if s.get('codec_type') == 'video'), {})
+    audio = next((s for s in probe['streams'] if s.get('codec_type') == 'audio'), {})
+    duration = float(probe['format'].get('duration') or video.get('duration') or 0)
+    info = {
+        'duration': duration,
+        'width': video.get('width'),
+        'height': video.get('height'),
+        'vcodec': video.get('codec_name'),
+        'acodec': audio.get('codec_name'),
+        'format': probe['format'].get('format_name'),
+        'bitrate': int(probe['format'].get('bit_rate') or 0),
+    }
+
+    thumbnails = []
+    if video and duration > 0:
+        for i in range(num_thumbnails):
+            # 输入端 -ss 快速定位，只解码关键帧
+            seek = duration * (i + 1) / (num_thumbnails + 1)
+            data, _ = (
+                ffmpeg
+                .input(path, ss=seek, skip_frame='nokey')
+                .output('pipe:', vframes=1, format='image2', vcodec='mjpeg',
+                        vf=f'scale={thumbnail_width}:-2', **{'q:v': 5})
+                .run(capture_stdout=True, capture_stderr=True)
+            )
+            if data:
+                thumbnails.append(data)
+    return info, thumbnails
+
+class LibraryIndex:
+    """媒体库索引：以SQLite保存元数据和缩略图，按文件大小和修改时间增量更新"""
+
+    COLUMNS = ('path', 'size', 'duration', 'width', 'height', 'vcodec', 'acodec')
+
+    def __init__(self, index_path=DEFAULT_INDEX_PATH):
+        os.makedirs(os.path.dirname(os.path.abspath(index_path)), exist_ok=True)
+        self.connection = sqlite3.connect(index_path)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.executescript('''
+            CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY,
+                size INTEGER,
+                mtime INTEGER,
+                duration REAL,
+                width INTEGER,
+                height INTEGER,
+                vcodec TEXT,
+                acodec TEXT,
+                format TEXT,
+                bitrate INTEGER,
+                error TEXT
+            );
+            CREATE TABLE IF NOT EXISTS thumbnails (
+                path TEXT,
+                idx INTEGER,
+                data BLOB,
+                PRIMARY KEY (path, idx)
+            );
+        ''')
+
+    def close(self):
+        self.connection.close()
+
+    def _root_filter(self, root):
+        root = os.path.join(os.path.abspath(root), '')
+        # 按前缀精确比较，只匹配该目录下的文件（LIKE 不区分大小写，会混入同名的其他目录）
+        return "substr(path, 1, ?) = ?", (len(root), root)
+
+    def scan(self, root, progress_callback=None, control=None, max_workers=8):
+        """扫描目录，只为新增或修改过的文件提取信息，返回 (新增/更新数, 删除数, 总数)"""
+        found = {}
+        for dir_path, _, file_names in os.walk(root):
+            for name in file_names:
+                if name.lower().endswith(VIDEO_EXTENSIONS):
+                    path = os.path.abspath(os.path.join(dir_path, name))
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    found[path] = (stat.st_size, stat.st_mtime_ns)
+
+        where, params = self._root_filter(root)
+        known = {
+            path: (size, mtime)
+            for path, size, mtime in self.connection.execute(
+                f"SELECT path, size, mtime FROM files WHERE {where}", params
+            )
+        }
+
+        removed = [path for path in known if path not in found]
+        changed = [path for path, signature in found.items() if known.get(path) != signature]
+        with self.connection:
+            self.connection.executemany("DELETE FROM files WHERE path = ?", [(p,) for p in removed])
+            self.connection.executemany("DELETE FROM thumbnails WHERE path = ?", [(p,) for p in removed])
+
+        def index_one(path):
+            if control:
+                control.checkpoint()
+            try:
+                return path, extract_media_info(path), None
+            except ffmpeg.Error as e:
+                return path, None, e.stderr.decode('utf8', errors='replace')[-500:]
+            except Exception as e:
+                return path, None, str(e)
+
+        # ffprobe/ffmpeg都是子进程，用线程池即可并行
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for count, (path, result, error) in enumerate(executor.map(index_one, changed), 1):
+                info, thumbnails = result if result else ({}, [])
+                size, mtime = found[path]
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (path, size, mtime, info.get('duration'), info.get('width'), info.get('height'),
+                     info.get('vcodec'), info.get('acodec'), info.get('format'), info.get('bitrate'), error)
+                )
+                self.connection.execute("DELETE FROM thumbnails WHERE path = ?", (path,))
+                self.connection.executemany(
+                    "INSERT INTO thumbnails VALUES (?, ?, ?)",
+                    [(path, idx, data) for idx, data in enumerate(thumbnails)]
+                )
+                # 分批提交，中途取消时已完成的部分也会保留
+                if count % 50 == 0:
+                    self.connection.commit()
+                if progress_callback:
+                    progress_callback(count / len(changed) * 100)
+        self.connection.commit()
+
+        print(f"媒体库扫描完成: {root} 共 {len(found)} 个文件，更新 {len(changed)} 个，删除 {len(removed)} 个")
+        return len(changed), len(removed), len(found)
+
+    def query(self, root, order_by='path', descending=False, offset=0, limit=200):
+        if order_by not in self.COLUMNS:
+            order_by = 'path'
+        where, params = self._root_filter(root)
+        return self.connection.execute(
+            f"SELECT {', '.join(self.COLUMNS)} FROM files WHERE {where} "
+            f"ORDER BY {order_by} {'DESC' if descending else 'ASC'}, path LIMIT ? OFFSET ?",
+            params + (limit, offset)
+        ).fetchall()
+
+    def count(self, root):
+        where, params = self._root_filter(root)
+        return self.connection.execute(f"SELECT COUNT(*) FROM files WHERE {where}", params).fetchone()[0]
+
+    def thumbnail(self, path, idx=0):
+        row = self.connection.execute(
+            "SELECT data FROM thumbnails WHERE path = ? AND idx = ?", (path, idx)
+        ).fetchone()
+        return row[0] if row else None
+
 class SettingsDialog(QDialog):
     def __init__(self, parent=None):
         super().__init__(parent)
@@ -40,6 +1677,20 @@ class SettingsDialog(QDialog):
         output_group.setLayout(group_layout)
         layout.addWidget(output_group)
         
+        # 任务服务设置组
+        service_group = QGroupBox("任务服务")
+        service_layout = QFormLayout()
+        
+        self.service_url = QLineEdit()
+        self.service_url.setPlaceholderText(f"留空则在本进程内处理，例如 http://{DEFAULT_SERVICE_HOST}:{DEFAULT_SERVICE_PORT}")
+        service_layout.addRow("服务地址:", self.service_url)
+        self.service_token = QLineEdit()
+        self.service_token.setEchoMode(QLineEdit.Password)
+        self.service_token.setPlaceholderText("留空则读取本机服务生成的令牌")
+        service_layout.addRow("访问令牌:", self.service_token)
+        service_group.setLayout(service_layout)
+        layout.addWidget(service_group)
+        
         # 确定和取消按钮
         button_layout = QHBoxLayout()
         save_btn = QPushButton("保存")
@@ -53,6 +1704,8 @@ class SettingsDialog(QDialog):
         # 加载已保存的设置
         self.settings = QSettings('VideoConverter', 'Settings')
         self.output_path.setText(self.settings.value('output_dir', ''))
+        self.service_url.setText(self.settings.value('service_url', ''))
+        self.service_token.setText(self.settings.value('service_token', ''))
         
     def browse_output_dir(self):
         dir_path = QFileDialog.getExistingDirectory(self, "选择输出目录")
@@ -61,141 +1714,238 @@ class SettingsDialog(QDialog):
             
     def save_settings(self):
         self.settings.setValue('output_dir', self.output_path.text())
+        self.settings.setValue('service_url', self.service_url.text().strip())
+        self.settings.setValue('service_token', self.service_token.text().strip())
+
+class ControllableThread(QThread):
+    """支持取消、暂停和恢复的处理线程基类"""
+    cancelled = Signal()
+    
+    def __init__(self):
+        super().__init__()
+        self.control = JobControl()
+        
+    def cancel(self):
+        self.control.cancel()
+        
+    def pause(self):
+        self.control.pause()
+        
+    def resume(self):
+        self.control.resume()
+        
+    def is_paused(self):
+        return self.control.paused
 
-class ConvertThread(QThread):
+class QueueDialog(QDialog):
+    """分布式队列面板：提交任务并汇总显示各工作进程的处理进度"""
+    
+    def __init__(self, parent=None, output_format='mp4', adaptive=False):
+        super().__init__(parent)
+        self.setWindowTitle("分布式队列")
+        self.setMinimumSize(700, 450)
+        self.settings = QSettings('VideoConverter', 'Settings')
+        self.output_format = output_format
+        self.adaptive = adaptive
+        self.queue = None
+        
+        layout = QVBoxLayout(self)
+        
+        # 队列目录
+        dir_layout = QHBoxLayout()
+        self.queue_dir_input = QLineEdit(self.settings.value('queue_dir', ''))
+        self.queue_dir_input.setPlaceholderText("所有工作节点都能访问的共享目录...")
+        browse_btn = QPushButton("浏览")
+        browse_btn.clicked.connect(self.browse_queue_dir)
+        dir_layout.addWidget(QLabel("队列目录:"))
+        dir_layout.addWidget(self.queue_dir_input)
+        dir_layout.addWidget(browse_btn)
+        layout.addLayout(dir_layout)
+        
+        # 汇总进度
+        self.summary_label = QLabel("未选择队列目录")
+        layout.addWidget(self.summary_label)
+        self.progress_bar = QProgressBar()
+        self.progress_bar.setRange(0, 100)
+        layout.addWidget(self.progress_bar)
+        
+        # 运行中的任务
+        self.job_table = QTableWidget(0, 4)
+        self.job_table.setHorizontalHeaderLabels(["任务", "输入文件", "工作进程", "进度"])
+        self.job_table.horizontalHeader().setSectionResizeMode(1, QHeaderView.Stretch)
+        self.job_table.setEditTriggers(QTableWidget.NoEditTriggers)
+        layout.addWidget(self.job_table)
+        
+        button_layout = QHBoxLayout()
+        add_btn = QPushButton(f"添加转换任务 ({output_format})")
+        add_btn.setIcon(self.style().standardIcon(QStyle.SP_FileIcon))
+        add_btn.clicked.connect(self.add_convert_jobs)
+        close_btn = QPushButton("关闭")
+        close_btn.clicked.connect(self.accept)
+        button_layout.addWidget(add_btn)
+        button_layout.addStretch()
+        button_layout.addWidget(close_btn)
+        layout.addLayout(button_layout)
+        
+        # 定时刷新队列状态
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.refresh)
+        self.timer.start(2000)
+        self.open_queue()
+        
+    def browse_queue_dir(self):
+        dir_path = QFileDialog.getExistingDirectory(self, "选择队列目录")
+        if dir_path:
+            self.queue_dir_input.setText(dir_path)
+            self.open_queue()
+            
+    def open_queue(self):
+        queue_dir = self.queue_dir_input.text()
+        if not queue_dir:
+            return
+        try:
+            self.queue = FileJobQueue(queue_dir)
+            self.settings.setValue('queue_dir', queue_dir)
+            self.refresh()
+        except OSError as e:
+            self.queue = None
+            QMessageBox.critical(self, "错误", f"无法打开队列目录: {str(e)}")
+            
+    def add_convert_jobs(self):
+        if self.queue is None:
+            QMessageBox.warning(self, "警告", "请先选择队列目录！")
+            return
+        
+        file_names, _ = QFileDialog.getOpenFileNames(
+            self,
+            "选择视频文件",
+            "",
+            "音视频文件 (*.mp4 *.avi *.mkv *.mov *.wmv *.m4a *.mp3 *.wav *.flac *.opus *.aac)"
+        )
+        if not file_names:
+            return
+        
+        output_dir = self.settings.value('output_dir', '')
+        if not output_dir:
+            output_dir = QFileDialog.getExistingDirectory(self, "选择输出目录（需位于共享存储上）")
+            if not output_dir:
+                return
+        
+        for input_file in file_names:
+            base_name = os.path.splitext(os.path.basename(input_file))[0]
+            output_file = os.path.join(output_dir, get_output_name(base_name, self.output_format))
+            self.queue.enqueue('convert', {'input': input_file, 'output': output_file, 'adaptive': self.adaptive})
+        self.refresh()
+        
+    def refresh(self):
+        if self.queue is None:
+            return
+        try:
+            status = self.queue.status()
+        except OSError as e:
+            self.summary_label.setText(f"读取队列失败: {str(e)}")
+            return
+        
+        counts = status['counts']
+        alive = sum(1 for worker in status['workers'] if worker['age'] < 60)
+        self.summary_label.setText(
+            f"等待 {counts['pending']}  运行 {counts['running']}  完成 {counts['done']}  "
+            f"失败 {counts['failed']}  在线工作进程 {alive}"
+        )
+        self.progress_bar.setValue(int(status['progress']))
+        
+        self.job_table.setRowCount(len(status['running']))
+        for row, job in enumerate(status['running']):
+            values = [job['id'], job['params']['input'], job.get('worker', ''), f"{job['progress']:.1f}%"]
+            for column, value in enumerate(values):
+                self.job_table.setItem(row, column, QTableWidgetItem(str(value)))
+
+class ConvertThread(ControllableThread):
     progress = Signal(float)
     finished = Signal()
     error = Signal(str)
     
-    def __init__(self, input_file, output_file):
+    def __init__(self, input_file, output_file, start_time=None, end_time=None, adaptive=False):
         super().__init__()
         self.input_file = input_file
         self.output_file = output_file
-        
-    def get_format_settings(self, output_file):
-        """根据输出文件格式返回适当的编码器设置"""
-        format_ext = output_file.lower().split('.')[-1]
-        settings = {
-            'mp4': {
-                'vcodec': 'libx264',
-                'acodec': 'aac',
-                'strict': 'experimental'
-            },
-            'avi': {
-                'vcodec': 'libx264',
-                'acodec': 'mp3',
-                'strict': 'experimental'
-            },
-            'mkv': {
-                'vcodec': 'libx264',
-                'acodec': 'aac',
-                'strict': 'experimental'
-            },
-            'mov': {
-                'vcodec': 'libx264',
-                'acodec': 'aac',
-                'strict': 'experimental'
-            },
-            'wmv': {
-                'vcodec': 'msmpeg4',
-                'acodec': 'wmav2',
-                'strict': 'experimental'
-            }
-        }
-        return settings.get(format_ext, {})
+        self.start_time = start_time
+        self.end_time = end_time
+        self.adaptive = adaptive
         
     def run(self):
         try:
-            # 获取视频总时长
-            probe = ffmpeg.probe(self.input_file)
-            total_duration = float(probe['streams'][0]['duration'])
-            
-            # 获取输出格式的编码器设置
-            format_settings = self.get_format_settings(self.output_file)
-            
-            # 设置ffmpeg命令
-            stream = (
-                ffmpeg
-                .input(self.input_file)
-                .output(self.output_file,
-                       **format_settings,
-                       **{
-                           'loglevel': 'info',
-                           'stats': None,
-                           'b:v': '2500k',
-                           'b:a': '192k',
-                           'copyts': None,
-                           'vsync': 0,
-                       })
-                .overwrite_output()
+            convert_video(
+                self.input_file,
+                self.output_file,
+                progress_callback=self.progress.emit,
+                control=self.control,
+                start_time=self.start_time,
+                end_time=self.end_time,
+                adaptive=self.adaptive
             )
-            
-            # 获取完整的ffmpeg命令用于调试
-            cmd = ffmpeg.compile(stream)
-            print(f"开始转换: {' '.join(cmd)}")
-            
-            process = stream.run_async(pipe_stdout=True, pipe_stderr=True)
-            
-            # 收集错误输出
-            error_output = []
-            last_progress = 0
-            
-            # 监控转换进度
-            while process.poll() is None:
-                line = process.stderr.readline().decode('utf8', errors='replace')
-                if line:
-                    print(f"FFmpeg output: {line.strip()}")
-                    error_output.append(line)
-                    
-                    # 尝试从不同格式的时间信息中提取进度
-                    try:
-                        if "time=" in line:
-                            # 提取时间信息
-                            time_str = line.split("time=")[1].split()[0]
-                            if time_str != 'N/A':
-                                # 将时间转换为秒
-                                if ":" in time_str:
-                                    h, m, s = map(float, time_str.split(':'))
-                                    current_seconds = h * 3600 + m * 60 + s
-                                else:
-                                    current_seconds = float(time_str)
-                                
-                                # 计算进度百分比
-                                progress = min((current_seconds / total_duration) * 100, 99)
-                                if progress > last_progress:
-                                    self.progress.emit(progress)
-                                    last_progress = progress
-                                    print(f"转换进度: {progress:.1f}%")
-                    except Exception as e:
-                        print(f"Progress parsing error: {e}")
-                        continue
-            
-            process.wait()
-            
-            if process.returncode != 0:
-                error_msg = ''.join(error_output)
-                print(f"转换失败: {error_msg}")
-                raise Exception(f"转换失败。FFmpeg输出:\n{error_msg}")
-            
-            print("转换完成")
             self.progress.emit(100)
             self.finished.emit()
             
+        except JobCancelled:
+            print("转换已取消")
+            self.cancelled.emit()
         except Exception as e:
             print(f"转换错误: {str(e)}")
             self.error.emit(str(e))
-        finally:
-            # 确保在线程结束时关闭所有资源
-            if 'process' in locals():
-                try:
-                    process.kill()
-                except:
-                    pass
 
     def __del__(self):
         self.wait()
 
-class WatermarkRemoverThread(QThread):
+class RemoteJobThread(ControllableThread):
+    """把任务提交给任务服务并轮询其进度，信号与本地处理线程一致"""
+    progress = Signal(float)
+    finished = Signal()
+    error = Signal(str)
+    
+    def __init__(self, service_url, job_type, token=None, temp_files=(), **params):
+        super().__init__()
+        self.client = JobServiceClient(service_url, token)
+        self.job_type = job_type
+        self.params = params
+        # 任务结束后需要删除的临时文件（如提交给服务的遮罩）
+        self.temp_files = list(temp_files)
+        
+    def sync_control(self, job):
+        """把界面上的取消/暂停操作转发给服务端，在处理线程中发送请求，不阻塞界面"""
+        if self.control.cancelled:
+            return self.client.cancel(job['id'])
+        if self.control.paused and job['status'] == 'running':
+            return self.client.pause(job['id'])
+        if not self.control.paused and job['status'] == 'paused':
+            return self.client.resume(job['id'])
+        return self.client.status(job['id'])
+        
+    def run(self):
+        try:
+            job = self.client.submit(self.job_type, **self.params)
+            while job['status'] in ('queued', 'running', 'paused'):
+                self.progress.emit(job['progress'])
+                self.msleep(500)
+                job = self.sync_control(job)
+            
+            if job['status'] == 'finished':
+                self.progress.emit(100)
+                self.finished.emit()
+            elif job['status'] == 'cancelled':
+                self.cancelled.emit()
+            else:
+                self.error.emit(job['error'] or "任务失败")
+        except Exception as e:
+            self.error.emit(f"任务服务出错: {str(e)}")
+        finally:
+            for path in self.temp_files:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+class WatermarkRemoverThread(ControllableThread):
     progress = Signal(float)
     finished = Signal()
     error = Signal(str)
@@ -208,66 +1958,231 @@ class WatermarkRemoverThread(QThread):
         
     def run(self):
         try:
-            video_clip = VideoFileClip(self.input_file)
-            total_frames = int(video_clip.duration * video_clip.fps)
-            current_frame = 0
-            
-            def process_frame(frame):
-                nonlocal current_frame
-                current_frame += 1
-                # 只在未达到100%时发送进度信号
-                if current_frame < total_frames:
-                    self.progress.emit((current_frame / total_frames) * 100)
-                return self.remove_watermark(frame)
-            
-            processed_video = video_clip.fl_image(process_frame)
-            processed_video.write_videofile(
+            remove_watermark_from_video(
+                self.input_file,
                 self.output_file,
-                audio_codec='aac',
-                audio_bitrate='192k',
-                preset='slow',
-                threads=4
+                self.watermark_mask,
+                progress_callback=self.progress.emit,
+                control=self.control
             )
             
-            video_clip.close()
-            processed_video.close()
-            
             # 最后一次进度更新和完成信号一起发送
             self.progress.emit(100)
             self.finished.emit()
+        except JobCancelled:
+            self.cancelled.emit()
         except Exception as e:
             self.error.emit(str(e))
-            
-    def remove_watermark(self, frame):
-        """改进的水印去除方法"""
-        frame_float = frame.astype(np.float32) / 255.0
-        
-        mask_region = self.watermark_mask > 0
+
+class WatermarkBatchThread(ControllableThread):
+    """使用同一个水印遮罩批量处理文件夹中的视频"""
+    progress = Signal(float)
+    file_started = Signal(str)
+    finished = Signal(list)
+    error = Signal(str)
+    
+    def __init__(self, input_files, output_dir, watermark_mask):
+        super().__init__()
+        self.input_files = input_files
+        self.output_dir = output_dir
+        self.watermark_mask = watermark_mask
         
-        kernel = np.ones((5,5), np.uint8)
-        expanded_mask = cv2.dilate(self.watermark_mask, kernel, iterations=2)
-        sample_region = expanded_mask > 0
+    def run(self):
+        try:
+            skipped = run_watermark_batch(
+                self.input_files,
+                self.output_dir,
+                self.watermark_mask,
+                progress_callback=self.progress.emit,
+                file_callback=self.file_started.emit,
+                control=self.control
+            )
+            self.progress.emit(100)
+            self.finished.emit(skipped)
+        except JobCancelled:
+            self.cancelled.emit()
+        except Exception as e:
+            self.error.emit(str(e))
+
+class IndexThread(ControllableThread):
+    """在后台扫描目录并更新媒体库索引"""
+    progress = Signal(float)
+    finished = Signal(int, int, int)
+    error = Signal(str)
+    
+    def __init__(self, root, index_path=DEFAULT_INDEX_PATH):
+        super().__init__()
+        self.root = root
+        self.index_path = index_path
         
-        for c in range(3):
-            channel = frame_float[:,:,c]
+    def run(self):
+        # SQLite连接只能在创建它的线程中使用
+        index = LibraryIndex(self.index_path)
+        try:
+            changed, removed, total = index.scan(self.root, self.progress.emit, self.control)
+            self.finished.emit(changed, removed, total)
+        except JobCancelled:
+            self.cancelled.emit()
+        except Exception as e:
+            self.error.emit(str(e))
+        finally:
+            index.close()
+
+class LibraryModel(QAbstractTableModel):
+    """媒体库表格模型：分页加载行，缩略图在显示时才读取"""
+    
+    HEADERS = ["缩略图", "文件名", "时长", "分辨率", "视频编码", "音频编码", "大小"]
+    # 每一列对应的排序字段
+    SORT_FIELDS = ['path', 'path', 'duration', 'width', 'vcodec', 'acodec', 'size']
+    PAGE_SIZE = 200
+    
+    def __init__(self, index_path=DEFAULT_INDEX_PATH, parent=None):
+        super().__init__(parent)
+        self.index = LibraryIndex(index_path)
+        self.root = None
+        self.rows = []
+        self.total = 0
+        self.order_by = 'path'
+        self.descending = False
+        self.thumbnail_cache = {}
+        
+    def set_root(self, root):
+        self.root = root
+        self.reload()
+        
+    def reload(self):
+        self.beginResetModel()
+        self.rows = []
+        self.thumbnail_cache.clear()
+        self.total = self.index.count(self.root) if self.root else 0
+        self.endResetModel()
+        
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+        
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.HEADERS)
+        
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and len(self.rows) < self.total
+        
+    def fetchMore(self, parent=QModelIndex()):
+        rows = self.index.query(self.root, self.order_by, self.descending, len(self.rows), self.PAGE_SIZE)
+        if not rows:
+            self.total = len(self.rows)
+            return
+        self.beginInsertRows(QModelIndex(), len(self.rows), len(self.rows) + len(rows) - 1)
+        self.rows.extend(rows)
+        self.endInsertRows()
+        
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if orientation == Qt.Horizontal and role == Qt.DisplayRole:
+            return self.HEADERS[section]
+        return None
+        
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        path, size, duration, width, height, vcodec, acodec = self.rows[index.row()]
+        column = index.column()
+        
+        if role == Qt.DecorationRole and column == 0:
+            if path not in self.thumbnail_cache:
+                # 只缓存最近显示的缩略图，滚动大目录时内存不会无限增长
+                if len(self.thumbnail_cache) > 500:
+                    self.thumbnail_cache.clear()
+                pixmap = QPixmap()
+                data = self.index.thumbnail(path)
+                if data:
+                    pixmap.loadFromData(data)
+                self.thumbnail_cache[path] = pixmap
+            return self.thumbnail_cache[path]
+        
+        if role == Qt.ToolTipRole:
+            return path
+        
+        if role == Qt.DisplayRole:
+            if column == 1:
+                return os.path.basename(path)
+            if column == 2 and duration:
+                return time.strftime('%H:%M:%S', time.gmtime(duration))
+            if column == 3 and width:
+                return f"{width}x{height}"
+            if column == 4:
+                return vcodec or ""
+            if column == 5:
+                return acodec or ""
+            if column == 6:
+                return f"{size / 1024 / 1024:.1f} MB"
+        return None
+        
+    def sort(self, column, order=Qt.AscendingOrder):
+        self.order_by = self.SORT_FIELDS[column]
+        self.descending = order == Qt.DescendingOrder
+        self.reload()
+        
+    def path_at(self, row):
+        return self.rows[row][0]
+
+class JobControlBar(QWidget):
+    """运行中任务的暂停/继续和取消按钮"""
+    
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.thread = None
+        
+        layout = QHBoxLayout(self)
+        layout.setContentsMargins(0, 0, 0, 0)
+        
+        self.pause_button = QPushButton("暂停")
+        self.pause_button.setIcon(self.style().standardIcon(QStyle.SP_MediaPause))
+        self.pause_button.clicked.connect(self.toggle_pause)
+        
+        self.cancel_button = QPushButton("取消")
+        self.cancel_button.setIcon(self.style().standardIcon(QStyle.SP_MediaStop))
+        self.cancel_button.clicked.connect(self.cancel)
+        
+        layout.addStretch()
+        layout.addWidget(self.pause_button)
+        layout.addWidget(self.cancel_button)
+        self.hide()
+        
+    def attach(self, thread):
+        self.thread = thread
+        self.pause_button.setText("暂停")
+        self.pause_button.setIcon(self.style().standardIcon(QStyle.SP_MediaPause))
+        self.pause_button.setEnabled(True)
+        self.cancel_button.setEnabled(True)
+        self.show()
+        
+    def detach(self):
+        self.thread = None
+        self.hide()
+        
+    def toggle_pause(self):
+        if self.thread is None:
+            return
+        if self.thread.is_paused():
+            self.thread.resume()
+            self.pause_button.setText("暂停")
+            self.pause_button.setIcon(self.style().standardIcon(QStyle.SP_MediaPause))
+        else:
+            self.thread.pause()
+            self.pause_button.setText("继续")
+            self.pause_button.setIcon(self.style().standardIcon(QStyle.SP_MediaPlay))
             
-            surrounding_pixels = channel[sample_region & ~mask_region]
-            if len(surrounding_pixels) > 0:
-                mean_value = np.mean(surrounding_pixels)
-                std_value = np.std(surrounding_pixels)
-                
-                texture = np.random.normal(mean_value, std_value, channel[mask_region].shape)
-                
-                channel[mask_region] = np.clip(texture, 0, 1)
-        
-        result = cv2.inpaint(
-            (frame_float * 255).astype(np.uint8),
-            self.watermark_mask,
-            3,
-            cv2.INPAINT_TELEA
-        )
-        
-        return np.clip(result, 0, 255).astype(np.uint8)
+    def cancel(self):
+        if self.thread is None:
+            return
+        self.pause_button.setEnabled(False)
+        self.cancel_button.setEnabled(False)
+        self.thread.cancel()
+        
+    def stop_and_wait(self):
+        """关闭窗口时调用：取消任务并等待线程（及其子进程）结束"""
+        if self.thread is not None and self.thread.isRunning():
+            self.thread.cancel()
+            self.thread.wait()
 
 class VideoConverter(QMainWindow):
     def __init__(self):
@@ -307,17 +2222,70 @@ class VideoConverter(QMainWindow):
         file_group.setLayout(file_layout)
         layout.addWidget(file_group)
         
+        # 媒体库
+        library_group = QGroupBox("媒体库")
+        library_layout = QVBoxLayout()
+        
+        library_bar = QHBoxLayout()
+        self.scan_button = QPushButton("扫描目录")
+        self.scan_button.setIcon(self.style().standardIcon(QStyle.SP_DirIcon))
+        self.scan_button.clicked.connect(self.scan_library)
+        self.library_label = QLabel("双击文件即可选为输入")
+        library_bar.addWidget(self.scan_button)
+        library_bar.addWidget(self.library_label)
+        library_bar.addStretch()
+        library_layout.addLayout(library_bar)
+        
+        self.library_model = LibraryModel(parent=self)
+        self.library_view = QTableView()
+        self.library_view.setModel(self.library_model)
+        self.library_view.setSortingEnabled(True)
+        self.library_view.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.library_view.setIconSize(QSize(96, 54))
+        self.library_view.verticalHeader().setDefaultSectionSize(58)
+        self.library_view.horizontalHeader().setSectionResizeMode(1, QHeaderView.Stretch)
+        self.library_view.doubleClicked.connect(
+            lambda index: self.file_input.setText(self.library_model.path_at(index.row()))
+        )
+        library_layout.addWidget(self.library_view)
+        library_group.setLayout(library_layout)
+        layout.addWidget(library_group)
+        
+        library_dir = self.settings.value('library_dir', '')
+        if library_dir:
+            self.library_model.set_root(library_dir)
+        
         # 转换设置组
         convert_group = QGroupBox("转换设置")
         convert_layout = QHBoxLayout()
         
         self.format_label = QLabel("输出格式:")
         self.format_combo = QComboBox()
-        self.format_combo.addItems(["mp4", "avi", "mkv", "mov", "wmv"])
+        self.format_combo.addItems(["mp4", "avi", "mkv", "mov", "wmv", "m4a", "mp3", "opus", "HLS", "DASH"])
+        
+        # 多码率仅对HLS/DASH打包有效
+        self.adaptive_check = QCheckBox("多码率")
+        self.adaptive_check.setEnabled(False)
+        self.format_combo.currentTextChanged.connect(
+            lambda text: self.adaptive_check.setEnabled(text in ('HLS', 'DASH'))
+        )
+        
+        # 片段剪切：留空表示从头开始/到结尾
+        self.start_input = QLineEdit()
+        self.start_input.setPlaceholderText("开始 (如 1:30)")
+        self.start_input.setMaximumWidth(110)
+        self.end_input = QLineEdit()
+        self.end_input.setPlaceholderText("结束 (如 1:40)")
+        self.end_input.setMaximumWidth(110)
         
         convert_layout.addWidget(self.format_label)
         convert_layout.addWidget(self.format_combo)
+        convert_layout.addWidget(self.adaptive_check)
         convert_layout.addStretch()
+        convert_layout.addWidget(QLabel("片段:"))
+        convert_layout.addWidget(self.start_input)
+        convert_layout.addWidget(QLabel("-"))
+        convert_layout.addWidget(self.end_input)
         convert_group.setLayout(convert_layout)
         layout.addWidget(convert_group)
         
@@ -327,6 +2295,10 @@ class VideoConverter(QMainWindow):
         self.progress_bar.hide()
         layout.addWidget(self.progress_bar)
         
+        # 暂停/取消按钮
+        self.job_control_bar = JobControlBar()
+        layout.addWidget(self.job_control_bar)
+        
         # 转换按钮
         self.convert_button = QPushButton("开始转换")
         self.convert_button.setIcon(self.style().standardIcon(QStyle.SP_MediaPlay))
@@ -358,6 +2330,11 @@ class VideoConverter(QMainWindow):
         watermark_action.triggered.connect(self.show_watermark_remover)
         tools_menu.addAction(watermark_action)
         
+        # 分布式队列菜单项
+        queue_action = QAction(QIcon(self.style().standardIcon(QStyle.SP_DriveNetIcon)), "分布式队列", self)
+        queue_action.triggered.connect(self.show_queue)
+        tools_menu.addAction(queue_action)
+        
         # 帮助菜单
         help_menu = menubar.addMenu("帮助")
         
@@ -412,7 +2389,7 @@ class VideoConverter(QMainWindow):
             self,
             "选择视频文件",
             "",
-            "视频文件 (*.mp4 *.avi *.mkv *.mov *.wmv)"
+            "音视频文件 (*.mp4 *.avi *.mkv *.mov *.wmv *.m4a *.mp3 *.wav *.flac *.opus *.aac)"
         )
         if file_name:
             self.file_input.setText(file_name)
@@ -420,6 +2397,14 @@ class VideoConverter(QMainWindow):
     def get_output_path(self, input_file, format):
         # 首先检查设置中的输出目录
         output_dir = self.settings.value('output_dir', '')
+        if format in ('HLS', 'DASH'):
+            # 打包输出包含多个文件，只需选择所在目录
+            if not output_dir:
+                output_dir = QFileDialog.getExistingDirectory(self, "选择打包输出目录")
+                if not output_dir:
+                    return None
+            base_name = os.path.splitext(os.path.basename(input_file))[0]
+            return os.path.join(output_dir, get_output_name(base_name, format))
         if not output_dir:
             # 如果没有设置输出目录，让用户选择保存位置
             file_name = os.path.basename(input_file)
@@ -428,7 +2413,7 @@ class VideoConverter(QMainWindow):
                 self,
                 "保存转换后的文件",
                 f"{base_name}.{format}",
-                f"视频文件 (*.{format})"
+                f"{'音频' if format in AUDIO_FORMATS else '视频'}文件 (*.{format})"
             )
             return output_file if output_file else None
         else:
@@ -443,6 +2428,13 @@ class VideoConverter(QMainWindow):
             QMessageBox.warning(self, "警告", "请先选择输入文件！")
             return
             
+        try:
+            start_time = parse_time(self.start_input.text())
+            end_time = parse_time(self.end_input.text())
+        except ValueError:
+            QMessageBox.warning(self, "警告", "片段时间格式不正确，请使用秒数或 时:分:秒 格式！")
+            return
+            
         output_format = self.format_combo.currentText()
         output_file = self.get_output_path(input_file, output_format)
         
@@ -453,11 +2445,21 @@ class VideoConverter(QMainWindow):
         self.progress_bar.setValue(0)
         self.convert_button.setEnabled(False)
         
-        # 创建并启动转换线程
-        self.convert_thread = ConvertThread(input_file, output_file)
+        # 创建并启动转换线程（配置了任务服务时交给服务处理）
+        adaptive = self.adaptive_check.isEnabled() and self.adaptive_check.isChecked()
+        service_url = self.settings.value('service_url', '')
+        if service_url:
+            self.convert_thread = RemoteJobThread(
+                service_url, 'convert', self.settings.value('service_token', ''),
+                input=input_file, output=output_file, start=start_time, end=end_time, adaptive=adaptive
+            )
+        else:
+            self.convert_thread = ConvertThread(input_file, output_file, start_time, end_time, adaptive)
         self.convert_thread.progress.connect(self.update_progress)
         self.convert_thread.finished.connect(self.conversion_finished)
         self.convert_thread.error.connect(self.conversion_error)
+        self.convert_thread.cancelled.connect(self.conversion_cancelled)
+        self.job_control_bar.attach(self.convert_thread)
         self.convert_thread.start()
         
     def update_progress(self, value):
@@ -466,23 +2468,65 @@ class VideoConverter(QMainWindow):
         
     def conversion_finished(self):
         self.progress_bar.hide()  # 完成时直接隐藏进度条
+        self.job_control_bar.detach()
         self.convert_button.setEnabled(True)
         QMessageBox.information(self, "成功", "视频转换完成！")
         
     def conversion_error(self, error_msg):
         self.progress_bar.hide()
+        self.job_control_bar.detach()
         self.convert_button.setEnabled(True)
         QMessageBox.critical(self, "错误", f"转换失败: {error_msg}")
+        
+    def conversion_cancelled(self):
+        self.progress_bar.hide()
+        self.job_control_bar.detach()
+        self.convert_button.setEnabled(True)
+
+    def scan_library(self):
+        root = QFileDialog.getExistingDirectory(
+            self, "选择要建立索引的视频目录", self.settings.value('library_dir', '')
+        )
+        if not root:
+            return
+        
+        self.settings.setValue('library_dir', root)
+        self.library_model.set_root(root)
+        self.scan_button.setEnabled(False)
+        self.library_label.setText("正在扫描...")
+        
+        self.index_thread = IndexThread(root)
+        self.index_thread.progress.connect(lambda value: self.library_label.setText(f"正在扫描... {value:.0f}%"))
+        self.index_thread.finished.connect(self.library_scan_finished)
+        self.index_thread.error.connect(self.library_scan_error)
+        self.index_thread.start()
+        
+    def library_scan_finished(self, changed, removed, total):
+        self.scan_button.setEnabled(True)
+        self.library_label.setText(f"共 {total} 个文件（更新 {changed} 个，移除 {removed} 个）")
+        self.library_model.reload()
+        
+    def library_scan_error(self, error_msg):
+        self.scan_button.setEnabled(True)
+        self.library_label.setText("扫描失败")
+        QMessageBox.critical(self, "错误", f"扫描媒体库失败: {error_msg}")
+        
+    def show_queue(self):
+        dialog = QueueDialog(self, self.format_combo.currentText(), self.adaptive_check.isChecked())
+        dialog.exec()
 
     def show_watermark_remover(self):
         self.watermark_remover = WatermarkRemover(self)
         self.watermark_remover.show()
 
     def closeEvent(self, event):
-        # 确保在关闭窗口时停止所有正在运行的线程
-        if hasattr(self, 'convert_thread') and self.convert_thread.isRunning():
-            self.convert_thread.terminate()
-            self.convert_thread.wait()
+        # 确保在关闭窗口时停止所有正在运行的线程和ffmpeg进程
+        self.job_control_bar.stop_and_wait()
+        if hasattr(self, 'index_thread') and self.index_thread.isRunning():
+            self.index_thread.cancel()
+            self.index_thread.wait()
+        if hasattr(self, 'watermark_remover'):
+            self.watermark_remover.close()
         event.accept()
 
 class WatermarkRemover(QMainWindow):
@@ -491,6 +2535,7 @@ class WatermarkRemover(QMainWindow):
         self.setWindowTitle("视频水印去除")
         self.setMinimumWidth(600)
         self.watermark_mask = None
+        self.watermark_roi = None
         self.settings = QSettings('VideoConverter', 'Settings')
         
         # 主窗口部件
@@ -519,7 +2564,39 @@ class WatermarkRemover(QMainWindow):
         # 水印选择按钮
         self.select_watermark_button = QPushButton("选择水印区域")
         self.select_watermark_button.clicked.connect(self.select_watermark)
-        layout.addWidget(self.select_watermark_button)
+        self.auto_detect_button = QPushButton("自动检测水印")
+        self.auto_detect_button.clicked.connect(self.auto_detect_watermark)
+        
+        select_layout = QHBoxLayout()
+        select_layout.addWidget(self.select_watermark_button)
+        select_layout.addWidget(self.auto_detect_button)
+        layout.addLayout(select_layout)
+        
+        # 遮罩保存/加载及批量处理
+        mask_group = QGroupBox("水印遮罩")
+        mask_layout = QHBoxLayout()
+        
+        self.save_mask_button = QPushButton("保存遮罩")
+        self.save_mask_button.setIcon(self.style().standardIcon(QStyle.SP_DialogSaveButton))
+        self.save_mask_button.clicked.connect(self.save_mask)
+        
+        self.load_mask_button = QPushButton("加载遮罩")
+        self.load_mask_button.setIcon(self.style().standardIcon(QStyle.SP_DialogOpenButton))
+        self.load_mask_button.clicked.connect(self.load_mask)
+        
+        self.batch_button = QPushButton("批量处理文件夹")
+        self.batch_button.setIcon(self.style().standardIcon(QStyle.SP_DirIcon))
+        self.batch_button.clicked.connect(self.process_folder)
+        
+        self.mask_label = QLabel("未加载遮罩")
+        
+        mask_layout.addWidget(self.save_mask_button)
+        mask_layout.addWidget(self.load_mask_button)
+        mask_layout.addWidget(self.batch_button)
+        mask_layout.addWidget(self.mask_label)
+        mask_layout.addStretch()
+        mask_group.setLayout(mask_layout)
+        layout.addWidget(mask_group)
         
         # 进度显示
         self.progress_bar = QProgressBar()
@@ -527,6 +2604,10 @@ class WatermarkRemover(QMainWindow):
         self.progress_bar.hide()
         layout.addWidget(self.progress_bar)
         
+        # 暂停/取消按钮
+        self.job_control_bar = JobControlBar()
+        layout.addWidget(self.job_control_bar)
+        
         # 处理按钮
         self.process_button = QPushButton("开始处理")
         self.process_button.setIcon(self.style().standardIcon(QStyle.SP_MediaPlay))
@@ -552,7 +2633,7 @@ class WatermarkRemover(QMainWindow):
             
         try:
             video_clip = VideoFileClip(input_file)
-            frame = self.get_first_valid_frame(video_clip)
+            frame = get_first_valid_frame(video_clip)
             
             # 将视频帧调整为720p显示
             display_height = 720
@@ -579,7 +2660,9 @@ class WatermarkRemover(QMainWindow):
                 int(r[3] / scale_factor)
             )
             
-            self.watermark_mask = self.generate_watermark_mask(video_clip, r_original)
+            self.watermark_mask = generate_watermark_mask(video_clip, r_original)
+            self.watermark_roi = r_original
+            self.mask_label.setText(f"遮罩来源: {os.path.basename(input_file)}")
             video_clip.close()
             
             QMessageBox.information(self, "成功", "水���区域选择完成！")
@@ -588,40 +2671,6 @@ class WatermarkRemover(QMainWindow):
             QMessageBox.critical(self, "错误", f"选择水印区域时出错: {str(e)}")
             video_clip.close()
             
-    def get_first_valid_frame(self, video_clip, threshold=10, num_frames=10):
-        total_frames = int(video_clip.fps * video_clip.duration)
-        frame_indices = [int(i * total_frames / num_frames) for i in range(num_frames)]
-        
-        for idx in frame_indices:
-            frame = video_clip.get_frame(idx / video_clip.fps)
-            if frame.mean() > threshold:
-                return frame
-        
-        return video_clip.get_frame(0)
-        
-    def detect_watermark_adaptive(self, frame, roi):
-        roi_frame = frame[roi[1]:roi[1] + roi[3], roi[0]:roi[0] + roi[2]]
-        gray_frame = cv2.cvtColor(roi_frame, cv2.COLOR_BGR2GRAY)
-        _, binary_frame = cv2.threshold(gray_frame, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
-        
-        mask = np.zeros_like(frame[:, :, 0], dtype=np.uint8)
-        mask[roi[1]:roi[1] + roi[3], roi[0]:roi[0] + roi[2]] = binary_frame
-        
-        return mask
-        
-    def generate_watermark_mask(self, video_clip, roi, num_frames=10, min_frame_count=7):
-        total_frames = int(video_clip.duration * video_clip.fps)
-        frame_indices = [int(i * total_frames / num_frames) for i in range(num_frames)]
-        
-        frames = [video_clip.get_frame(idx / video_clip.fps) for idx in frame_indices]
-        masks = [self.detect_watermark_adaptive(frame, roi) for frame in frames]
-        
-        final_mask = sum((mask == 255).astype(np.uint8) for mask in masks)
-        final_mask = np.where(final_mask >= min_frame_count, 255, 0).astype(np.uint8)
-        
-        kernel = np.ones((5, 5), np.uint8)
-        return cv2.dilate(final_mask, kernel)
-        
     def get_output_path(self, input_file):
         # 首先检查设置中的输出目录
         output_dir = self.settings.value('output_dir', '')
@@ -642,6 +2691,129 @@ class WatermarkRemover(QMainWindow):
             base_name = os.path.splitext(file_name)[0]
             return os.path.join(output_dir, f"{base_name}_无水印.mp4")
         
+    def auto_detect_watermark(self):
+        input_file = self.file_input.text()
+        if not input_file:
+            QMessageBox.warning(self, "警告", "请先选择输入文件！")
+            return
+        
+        video_clip = None
+        try:
+            video_clip = VideoFileClip(input_file)
+            self.watermark_mask, self.watermark_roi = auto_generate_watermark_mask(video_clip)
+            self.mask_label.setText(f"自动检测: {os.path.basename(input_file)} {tuple(self.watermark_roi)}")
+            QMessageBox.information(self, "成功", "已自动检测到水印区域！")
+        except Exception as e:
+            QMessageBox.critical(self, "错误", f"自动检测水印时出错: {str(e)}")
+        finally:
+            if video_clip is not None:
+                video_clip.close()
+            
+    def save_mask(self):
+        if self.watermark_mask is None:
+            QMessageBox.warning(self, "警告", "请先选择水印区域！")
+            return
+        
+        # 默认以输入文件所在文件夹（通常是频道名）命名遮罩
+        input_file = self.file_input.text()
+        channel = os.path.basename(os.path.dirname(input_file)) if input_file else "watermark"
+        mask_dir = self.settings.value('mask_dir', DEFAULT_MASK_DIR)
+        os.makedirs(mask_dir, exist_ok=True)
+        
+        file_name, _ = QFileDialog.getSaveFileName(
+            self,
+            "保存水印遮罩",
+            os.path.join(mask_dir, f"{channel}{MASK_FILE_SUFFIX}"),
+            f"水印遮罩 (*{MASK_FILE_SUFFIX})"
+        )
+        if not file_name:
+            return
+        
+        try:
+            saved_path = save_watermark_mask(
+                file_name,
+                self.watermark_mask,
+                roi=self.watermark_roi,
+                source=input_file,
+                params={'num_frames': 10, 'min_frame_count': 7}
+            )
+            self.settings.setValue('mask_dir', os.path.dirname(saved_path))
+            QMessageBox.information(self, "成功", f"水印遮罩已保存到:\n{saved_path}")
+        except Exception as e:
+            QMessageBox.critical(self, "错误", f"保存水印遮罩时出错: {str(e)}")
+            
+    def load_mask(self):
+        file_name, _ = QFileDialog.getOpenFileName(
+            self,
+            "加载水印遮罩",
+            self.settings.value('mask_dir', DEFAULT_MASK_DIR),
+            f"水印遮罩 (*{MASK_FILE_SUFFIX})"
+        )
+        if not file_name:
+            return
+        
+        try:
+            self.watermark_mask, metadata = load_watermark_mask(file_name)
+            self.watermark_roi = metadata.get('roi')
+            self.settings.setValue('mask_dir', os.path.dirname(file_name))
+            self.mask_label.setText(
+                f"已加载: {os.path.basename(file_name)} ({metadata['width']}x{metadata['height']})"
+            )
+        except Exception as e:
+            QMessageBox.critical(self, "错误", f"加载水印遮罩时出错: {str(e)}")
+            
+    def process_folder(self):
+        watermark_mask = self.watermark_mask
+        if watermark_mask is None:
+            reply = QMessageBox.question(
+                self, "提示", "尚未选择或加载水印遮罩，是否对每个文件自动检测水印？"
+            )
+            if reply != QMessageBox.Yes:
+                return
+        
+        input_dir = QFileDialog.getExistingDirectory(self, "选择要批量处理的视频文件夹")
+        if not input_dir:
+            return
+        
+        input_files = list_video_files(input_dir)
+        if not input_files:
+            QMessageBox.warning(self, "警告", "该文件夹中没有可处理的视频文件！")
+            return
+        
+        output_dir = self.settings.value('output_dir', '')
+        if not output_dir:
+            output_dir = QFileDialog.getExistingDirectory(self, "选择输出目录")
+            if not output_dir:
+                return
+        
+        self.progress_bar.show()
+        self.progress_bar.setValue(0)
+        self.process_button.setEnabled(False)
+        self.batch_button.setEnabled(False)
+        
+        self.batch_thread = WatermarkBatchThread(input_files, output_dir, watermark_mask)
+        self.batch_thread.progress.connect(self.update_progress)
+        self.batch_thread.file_started.connect(
+            lambda path: self.progress_bar.setFormat(f"{os.path.basename(path)} - %p%")
+        )
+        self.batch_thread.finished.connect(self.batch_finished)
+        self.batch_thread.error.connect(self.process_error)
+        self.batch_thread.cancelled.connect(self.process_cancelled)
+        self.job_control_bar.attach(self.batch_thread)
+        self.batch_thread.start()
+        
+    def batch_finished(self, skipped):
+        self.progress_bar.hide()
+        self.progress_bar.resetFormat()
+        self.job_control_bar.detach()
+        self.process_button.setEnabled(True)
+        self.batch_button.setEnabled(True)
+        if skipped:
+            details = "\n".join(f"{os.path.basename(path)}: {reason}" for path, reason in skipped)
+            QMessageBox.warning(self, "完成", f"批量处理完成，以下文件被跳过:\n{details}")
+        else:
+            QMessageBox.information(self, "成功", "批量水印去除完成！")
+        
     def process_video(self):
         if self.watermark_mask is None:
             QMessageBox.warning(self, "警告", "请先选择水印区域！")
@@ -661,12 +2833,28 @@ class WatermarkRemover(QMainWindow):
         self.progress_bar.show()
         self.progress_bar.setValue(0)
         self.process_button.setEnabled(False)
-        
-        # 创建并启动处理线程
-        self.process_thread = WatermarkRemoverThread(input_file, output_file, self.watermark_mask)
+        self.batch_button.setEnabled(False)
+        
+        # 创建并启动处理线程（配置了任务服务时交给服务处理）
+        service_url = self.settings.value('service_url', '')
+        if service_url:
+            mask_file = save_watermark_mask(
+                os.path.join(tempfile.gettempdir(), uuid.uuid4().hex),
+                self.watermark_mask,
+                roi=self.watermark_roi,
+                source=input_file
+            )
+            self.process_thread = RemoteJobThread(
+                service_url, 'watermark', self.settings.value('service_token', ''), temp_files=[mask_file],
+                input=input_file, output=output_file, mask=mask_file
+            )
+        else:
+            self.process_thread = WatermarkRemoverThread(input_file, output_file, self.watermark_mask)
         self.process_thread.progress.connect(self.update_progress)
         self.process_thread.finished.connect(self.process_finished)
         self.process_thread.error.connect(self.process_error)
+        self.process_thread.cancelled.connect(self.process_cancelled)
+        self.job_control_bar.attach(self.process_thread)
         self.process_thread.start()
         
     def update_progress(self, value):
@@ -675,15 +2863,151 @@ class WatermarkRemover(QMainWindow):
     def process_finished(self):
         self.progress_bar.setValue(100)  # 确保进度条显示100%
         self.progress_bar.hide()
+        self.job_control_bar.detach()
         self.process_button.setEnabled(True)
+        self.batch_button.setEnabled(True)
         QMessageBox.information(self, "成功", "视频水印去除完成！")
         
     def process_error(self, error_msg):
         self.progress_bar.hide()
+        self.progress_bar.resetFormat()
+        self.job_control_bar.detach()
         self.process_button.setEnabled(True)
+        self.batch_button.setEnabled(True)
         QMessageBox.critical(self, "错误", f"处理失败: {error_msg}")
+        
+    def process_cancelled(self):
+        self.progress_bar.hide()
+        self.progress_bar.resetFormat()
+        self.job_control_bar.detach()
+        self.process_button.setEnabled(True)
+        self.batch_button.setEnabled(True)
+        
+    def closeEvent(self, event):
+        # 关闭窗口时取消正在处理的任务，不留下后台的ffmpeg进程
+        self.job_control_bar.stop_and_wait()
+        event.accept()
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="视频处理工具")
+    parser.add_argument('--mask', help="批量去除水印时使用的水印遮罩文件")
+    parser.add_argument('--auto', action='store_true', help="不使用遮罩文件，逐个文件自动检测水印")
+    parser.add_argument('--input-dir', help="批量处理的视频文件夹")
+    parser.add_argument('--output-dir', help="批量处理的输出目录")
+    parser.add_argument('--serve', action='store_true', help="以无界面方式运行本地任务服务")
+    parser.add_argument('--host', default=DEFAULT_SERVICE_HOST, help="任务服务监听地址")
+    parser.add_argument('--port', type=int, default=DEFAULT_SERVICE_PORT, help="任务服务监听端口")
+    parser.add_argument('--workers', type=int, default=2, help="任务服务同时处理的任务数")
+    parser.add_argument('--token', help="任务服务的访问令牌，默认使用自动生成并保存在本机的令牌")
+    parser.add_argument('--queue-dir', help="分布式队列所在的共享目录")
+    parser.add_argument('--worker', action='store_true', help="作为工作进程从分布式队列领取任务")
+    parser.add_argument('--worker-id', help="工作进程名称，默认为 主机名-进程号")
+    parser.add_argument('--coordinator', action='store_true', help="作为协调进程回收失去响应的任务")
+    parser.add_argument('--heartbeat-timeout', type=int, default=60, help="工作进程心跳超时秒数")
+    parser.add_argument('--max-attempts', type=int, default=3, help="任务最多尝试次数")
+    parser.add_argument('--enqueue', choices=['convert', 'watermark'], help="向分布式队列提交一个任务")
+    parser.add_argument('--input', help="提交任务的输入文件，--convert 时可用 - 表示标准输入")
+    parser.add_argument('--output', help="提交任务的输出文件，--convert 时可用 - 表示标准输出")
+    parser.add_argument('--convert', action='store_true', help="不打开界面直接转换 --input 到 --output")
+    parser.add_argument('--start', help="只转换从该时间开始的片段（秒数或 时:分:秒）")
+    parser.add_argument('--end', help="只转换到该时间为止的片段（秒数或 时:分:秒）")
+    parser.add_argument('--format', help="输出格式，写入标准输出时使用（默认 mp4，不支持 avi）")
+    parser.add_argument('--adaptive', action='store_true', help="HLS/DASH 打包时输出多码率")
+    return parser.parse_args(argv)
+
+def run_queue_command(args):
+    """分布式队列相关的命令行入口，返回进程退出码"""
+    try:
+        if args.worker:
+            run_queue_worker(args.queue_dir, args.worker_id)
+        elif args.coordinator:
+            run_queue_coordinator(args.queue_dir, args.heartbeat_timeout, args.max_attempts)
+        elif args.enqueue:
+            if not (args.input and args.output):
+                print("提交任务需要同时指定 --input 和 --output")
+                return 2
+            params = {'input': os.path.abspath(args.input), 'output': os.path.abspath(args.output)}
+            if args.start or args.end:
+                params.update(start=args.start, end=args.end)
+            if args.adaptive:
+                params['adaptive'] = True
+            if args.mask:
+                params['mask'] = os.path.abspath(args.mask)
+            job = FileJobQueue(args.queue_dir).enqueue(args.enqueue, params)
+            print(f"任务已提交: {job['id']}")
+        else:
+            print(json.dumps(FileJobQueue(args.queue_dir).status(), ensure_ascii=False, indent=2))
+    except KeyboardInterrupt:
+        print("已停止")
+    return 0
+
+def run_convert_command(args):
+    """命令行转换单个文件，返回进程退出码"""
+    if not (args.input and args.output):
+        print("转换需要同时指定 --input 和 --output")
+        return 2
+    if args.output == PIPE_PATH:
+        # 标准输出留给视频数据，日志改写到标准错误
+        sys.stdout = sys.stderr
+    try:
+        convert_video(
+            args.input,
+            args.output,
+            start_time=parse_time(args.start),
+            end_time=parse_time(args.end),
+            output_format=args.format,
+            adaptive=args.adaptive
+        )
+    except Exception as e:
+        print(f"转换错误: {str(e)}")
+        return 1
+    return 0
+
+def run_headless(args):
+    """无界面批量去除水印，返回进程退出码"""
+    if not ((args.mask or args.auto) and args.input_dir and args.output_dir):
+        print("批量去除水印需要指定 --mask（或 --auto）、--input-dir 和 --output-dir")
+        return 2
+    
+    if args.mask:
+        watermark_mask, metadata = load_watermark_mask(args.mask)
+        print(f"已加载水印遮罩: {args.mask} ({metadata['width']}x{metadata['height']})")
+    else:
+        watermark_mask = None
+        print("未指定遮罩，将对每个文件自动检测水印")
+    
+    input_files = list_video_files(args.input_dir)
+    last_reported = -1
+    
+    def report_progress(value):
+        # 只在整数百分比变化时输出，避免刷屏
+        nonlocal last_reported
+        if int(value) > last_reported:
+            last_reported = int(value)
+            print(f"总进度: {last_reported}%")
+    
+    skipped = run_watermark_batch(input_files, args.output_dir, watermark_mask, progress_callback=report_progress)
+    print(f"批量处理完成: 成功 {len(input_files) - len(skipped)} 个, 跳过 {len(skipped)} 个")
+    return 1 if skipped else 0
 
 if __name__ == "__main__":
+    args = parse_args(sys.argv[1:])
+    if args.serve:
+        try:
+            asyncio.run(JobService(max_workers=args.workers, token=args.token).serve(args.host, args.port))
+        except KeyboardInterrupt:
+            print("任务服务已停止")
+        except ValueError as e:
+            print(f"任务服务无法启动: {str(e)}")
+            sys.exit(2)
+        sys.exit(0)
+    if args.convert:
+        sys.exit(run_convert_command(args))
+    if args.queue_dir:
+        sys.exit(run_queue_command(args))
+    if args.mask or args.auto or args.input_dir:
+        sys.exit(run_headless(args))
+    
     app = QApplication(sys.argv)
     
     # 设置应用程序样式